@@ -2,13 +2,24 @@ import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 import sqlite3
 import io
+import os
 import threading
 
 import cv2
 from PIL import Image, ImageTk
 
+from BTL_AI.ThuatToan_LBPH.Attendance import AttendanceRecorder, create_attendance_table
+from BTL_AI.ThuatToan_LBPH.CameraPipeline import CameraPipeline
+from BTL_AI.ThuatToan_LBPH.Detector import DetectionConfig
 from BTL_AI.ThuatToan_LBPH.Recognize import get_face_recognizer
-from BTL_AI.ThuatToan_LBPH.Train import train_face_recognizer
+from BTL_AI.ThuatToan_LBPH.Storage import (FileImageStore, add_images, create_student_tables, delete_images,
+                                           fetch_students_page, get_thumbnails)
+from BTL_AI.ThuatToan_LBPH.Timing import timed
+from BTL_AI.ThuatToan_LBPH.Tracker import FaceTracker
+from BTL_AI.ThuatToan_LBPH.Train import iter_images_from_database, train_face_recognizer
+
+# Phát hiện khuôn mặt trên ảnh camera thu nhỏ 2 lần; đặt roi=(x, y, w, h) để bỏ qua phần không cần thiết của lớp học
+CAMERA_DETECTION = DetectionConfig(downscale=2.0)
 
 
 class StudentManagementSystem:
@@ -19,21 +30,41 @@ class StudentManagementSystem:
 
         self.conn = sqlite3.connect('students.db')
         self.cursor = self.conn.cursor()
+        # ảnh mới được lưu thành file theo hash nội dung, cơ sở dữ liệu chỉ giữ thông tin và hash
+        self.image_store = FileImageStore()
         self.create_tables()
 
+        # danh sách sinh viên được nạp từng trang khi cuộn tới cuối
+        self.search_term = None
+        self.last_rowid = -1
+        self.all_loaded = False
+        self.page_pending = False
+
         self.create_widgets()
         self.load_students()
 
         # Khởi tạo camera
         self.cap = cv2.VideoCapture(0)
         self.is_capturing = False
+        self.pipeline = None
+        self.use_tracking = True
+        self.attendance = None
 
         # Khởi tạo face recognizer
-        self.face_recognizer = get_face_recognizer(self.cursor)
+        self.face_recognizer = get_face_recognizer(self.cursor, detection=CAMERA_DETECTION)
+        # Chế độ theo dõi: chỉ phát hiện/nhận diện mỗi vài khung hình, giữa các lần đó bám theo khuôn mặt
+        self.face_tracker = FaceTracker(self.face_recognizer)
+        # mô hình được train lại (ở đây hoặc bằng Train.py) được nạp vào mà không phải khởi động lại ứng dụng
+        self.face_recognizer.start_watching()
 
         self.master.protocol("WM_DELETE_WINDOW", self.on_closing)
 
     def on_closing(self):
+        self.face_recognizer.stop_watching()
+        if self.pipeline is not None:
+            self.pipeline.stop()
+        if self.attendance is not None:
+            self.attendance.close()
         if hasattr(self, 'cap'):
             self.cap.release()
         self.conn.close()
@@ -83,18 +114,11 @@ class StudentManagementSystem:
                 self.camera_label.config(image='')
 
     def create_tables(self):
-        self.cursor.execute('''CREATE TABLE IF NOT EXISTS students
-                              (msv TEXT PRIMARY KEY,
-                               name TEXT,
-                               birthdate TEXT,
-                               class TEXT)''')
-
-        self.cursor.execute('''CREATE TABLE IF NOT EXISTS face_images
-                              (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                               msv TEXT,
-                               image_number INTEGER,
-                               image BLOB,
-                               FOREIGN KEY(msv) REFERENCES students(msv))''')
+        # WAL: ghi điểm danh ở luồng nền không chặn giao diện đọc dữ liệu
+        self.cursor.execute('PRAGMA journal_mode=WAL')
+        # bảng sinh viên, ảnh khuôn mặt (có chỉ mục theo msv) và ảnh thu nhỏ
+        create_student_tables(self.cursor)
+        create_attendance_table(self.cursor)
         self.conn.commit()
 
     def create_widgets(self):
@@ -113,7 +137,8 @@ class StudentManagementSystem:
 
         scrollbar = ttk.Scrollbar(left_frame, orient=tk.VERTICAL, command=self.tree.yview)
         scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        self.tree.configure(yscrollcommand=scrollbar.set)
+        self.tree_scrollbar = scrollbar
+        self.tree.configure(yscrollcommand=self.on_tree_scroll)
 
         right_frame = ttk.Frame(main_frame)
         right_frame.pack(side=tk.RIGHT, fill=tk.BOTH, expand=True, padx=10)
@@ -146,6 +171,9 @@ class StudentManagementSystem:
         ttk.Button(button_frame, text="Thêm ảnh", command=self.add_image).pack(side=tk.LEFT, padx=5)
         ttk.Button(button_frame, text="Train Model", command=self.train_model).pack(side=tk.LEFT, padx=5)
         ttk.Button(button_frame, text="Check", command=self.check_face).pack(side=tk.LEFT, padx=5)
+        self.tracking_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(button_frame, text="Theo dõi", variable=self.tracking_var,
+                        command=self.on_tracking_toggle).pack(side=tk.LEFT, padx=5)
 
 
         search_frame = ttk.Frame(right_frame)
@@ -158,39 +186,81 @@ class StudentManagementSystem:
         # Thêm label để hiển thị hình ảnh từ camera
         self.camera_label = ttk.Label(right_frame)
         self.camera_label.pack(pady=10)
+        self.stats_label = ttk.Label(right_frame)
+        self.stats_label.pack()
 
         self.tree.bind('<<TreeviewSelect>>', self.on_tree_select)
 
     def check_face(self):
         if not self.is_capturing:
             self.is_capturing = True
+            self.face_tracker.reset()
+            self.use_tracking = self.tracking_var.get()
+            # mỗi sinh viên nhận ra được ghi điểm danh một lần trong buổi hôm nay
+            self.attendance = AttendanceRecorder('students.db')
+            self.face_recognizer.on_identified = self.attendance.record
+            # đọc camera, nhận diện và chuyển ảnh chạy trên các luồng riêng, luồng Tk chỉ hiển thị
+            self.pipeline = CameraPipeline(self.cap, self.process_frame)
+            self.pipeline.start()
             self.update_camera()
         else:
-            self.is_capturing = False
-            self.camera_label.config(image='')
+            self.stop_camera()
+
+    def stop_camera(self):
+        self.is_capturing = False
+        if self.pipeline is not None:
+            self.pipeline.stop()
+            self.pipeline = None
+        if self.attendance is not None:
+            self.face_recognizer.on_identified = None
+            self.attendance.close()
+            self.attendance = None
+        self.camera_label.config(image='')
+        self.stats_label.config(text='')
+
+    # chạy trên luồng nhận diện của pipeline
+    def process_frame(self, frame):
+        if self.use_tracking:
+            return self.face_tracker.process(frame)
+        return self.face_recognizer.recognize_face(frame)
+
+    def on_tracking_toggle(self):
+        self.use_tracking = self.tracking_var.get()
+        self.face_tracker.reset()
 
     def update_camera(self):
         if self.is_capturing:
-            ret, frame = self.cap.read()
-            if ret:
-                frame = cv2.flip(frame, 1)  # Lật hình ảnh ngang
-                recognized_frame, recognized_faces = self.face_recognizer.recognize_face(frame)
-
-                # Chuyển đổi frame để hiển thị trong Tkinter
-                rgb_frame = cv2.cvtColor(recognized_frame, cv2.COLOR_BGR2RGB)
-                img = Image.fromarray(rgb_frame)
-                imgtk = ImageTk.PhotoImage(image=img)
-                self.camera_label.imgtk = imgtk
-                self.camera_label.config(image=imgtk)
+            if self.pipeline.failed:
+                error = self.pipeline.error
+                self.stop_camera()
+                if error is not None:
+                    messagebox.showerror("Lỗi", f"Lỗi khi nhận diện: {error}")
+                return
+
+            result = self.pipeline.latest()
+            if result is not None:
+                img, recognized_faces = result
+                # thời gian hiển thị trên luồng Tk (bật bằng BTL_AI_TIMING=1)
+                with timed('ui_render'):
+                    imgtk = ImageTk.PhotoImage(image=img)
+                    self.camera_label.imgtk = imgtk
+                    self.camera_label.config(image=imgtk)
 
                 # Hiển thị thông tin nhận diện (nếu cần)
                 if recognized_faces:
                     print(recognized_faces)  # Hoặc hiển thị trong GUI
 
-                self.camera_label.after(10, self.update_camera)
-            else:
-                self.is_capturing = False
-                self.camera_label.config(image='')
+            # Thời gian xử lý từng bước và độ dài hàng đợi
+            report = self.pipeline.report()
+            self.stats_label.config(text=f"{report['fps']:.1f} FPS | "
+                                         f"đọc {report['capture']['avg_ms']:.0f} ms, "
+                                         f"nhận diện {report['recognize']['avg_ms']:.0f} ms, "
+                                         f"chuyển ảnh {report['render']['avg_ms']:.0f} ms | "
+                                         f"hàng đợi {report['queue_depth']['frames']}/"
+                                         f"{report['queue_depth']['annotated']} | "
+                                         f"đã điểm danh {self.attendance.count()}")
+
+            self.camera_label.after(15, self.update_camera)
 
     def __del__(self):
         if hasattr(self, 'cap'):
@@ -206,23 +276,43 @@ class StudentManagementSystem:
             messagebox.showerror("Lỗi", "Không có đủ dữ liệu để train. Hãy thêm sinh viên và ảnh trước.")
             return
 
-        self.cursor.execute("SELECT msv, image FROM face_images")
-        image_data = self.cursor.fetchall()
-
-        threading.Thread(target=self._train_model_thread, args=(image_data,)).start()
+        # thread train tự đọc ảnh theo từng lô qua kết nối riêng, không nạp hết ảnh vào bộ nhớ
+        threading.Thread(target=self._train_model_thread,
+                         args=(lambda: iter_images_from_database('students.db', store=self.image_store),)).start()
 
     def _train_model_thread(self, image_data):
         try:
-            num_persons = train_face_recognizer(image_data)
+            num_persons = train_face_recognizer(image_data, incremental=True, workers=os.cpu_count() or 1)
+            # camera đang chạy dùng mô hình mới ngay từ khung hình tiếp theo
+            self.face_recognizer.reload()
             self.master.after(0, lambda: messagebox.showinfo("Thành công", f"Đã train xong {num_persons} người."))
         except Exception as e:
             self.master.after(0, lambda: messagebox.showerror("Lỗi", f"Lỗi khi train model: {str(e)}"))
 
-    def load_students(self):
+    def load_students(self, search_term=None):
         self.tree.delete(*self.tree.get_children())
-        self.cursor.execute("SELECT msv, name, birthdate, class FROM students")
-        for row in self.cursor.fetchall():
-            self.tree.insert('', 'end', values=row)
+        self.search_term = search_term
+        self.last_rowid = -1
+        self.all_loaded = False
+        self.load_next_page()
+
+    def load_next_page(self):
+        self.page_pending = False
+        if self.all_loaded:
+            return
+        rows = fetch_students_page(self.cursor, self.last_rowid, self.search_term)
+        for row in rows:
+            self.tree.insert('', 'end', values=row[1:])
+        if rows:
+            self.last_rowid = rows[-1][0]
+        self.all_loaded = not rows
+
+    # cuộn gần tới cuối danh sách thì nạp thêm một trang
+    def on_tree_scroll(self, first, last):
+        self.tree_scrollbar.set(first, last)
+        if float(last) > 0.9 and not self.all_loaded and not self.page_pending:
+            self.page_pending = True
+            self.master.after_idle(self.load_next_page)
 
     def add_or_update_student(self):
         msv = self.msv_entry.get()
@@ -235,9 +325,13 @@ class StudentManagementSystem:
             return
 
         try:
-            self.cursor.execute('''INSERT OR REPLACE INTO students (msv, name, birthdate, class) 
-                                   VALUES (?, ?, ?, ?)''', (msv, name, birthdate, class_name))
+            # cập nhật tại chỗ (không xóa rồi thêm lại dòng) để giữ nguyên rowid trong chỉ mục tìm kiếm
+            self.cursor.execute('''INSERT INTO students (msv, name, birthdate, class) VALUES (?, ?, ?, ?)
+                                   ON CONFLICT(msv) DO UPDATE SET name=excluded.name, birthdate=excluded.birthdate,
+                                                                  class=excluded.class''',
+                                (msv, name, birthdate, class_name))
             self.conn.commit()
+            self.face_recognizer.refresh_names(self.cursor)
             self.load_students()
             messagebox.showinfo("Thành công", "Đã thêm/cập nhật sinh viên")
             self.clear_entries()
@@ -254,8 +348,10 @@ class StudentManagementSystem:
         if messagebox.askyesno("Xác nhận", f"Bạn có chắc muốn xóa sinh viên có MSV {msv}?"):
             try:
                 self.cursor.execute("DELETE FROM students WHERE msv=?", (msv,))
-                self.cursor.execute("DELETE FROM face_images WHERE msv=?", (msv,))
+                hashes = delete_images(self.cursor, msv)
                 self.conn.commit()
+                self.image_store.discard_unreferenced(self.cursor, hashes)
+                self.face_recognizer.refresh_names(self.cursor)
                 self.load_students()
                 messagebox.showinfo("Thành công", "Đã xóa sinh viên")
                 self.clear_entries()
@@ -263,13 +359,8 @@ class StudentManagementSystem:
                 messagebox.showerror("Lỗi", f"Không thể xóa: {e}")
 
     def search_student(self):
-        search_term = self.search_entry.get()
-        self.cursor.execute("""SELECT msv, name, birthdate, class FROM students 
-                               WHERE msv LIKE ? OR name LIKE ?""",
-                            ('%' + search_term + '%', '%' + search_term + '%'))
-        self.tree.delete(*self.tree.get_children())
-        for row in self.cursor.fetchall():
-            self.tree.insert('', 'end', values=row)
+        # tìm theo tiền tố của msv hoặc các từ trong tên, không phân biệt dấu (chỉ mục FTS5)
+        self.load_students(self.search_entry.get().strip() or None)
 
     def clear_entries(self):
         for entry in [self.msv_entry, self.name_entry, self.birthdate_entry, self.class_entry]:
@@ -290,10 +381,10 @@ class StudentManagementSystem:
             messagebox.showerror("Lỗi", "Vui lòng chọn sinh viên để xem ảnh")
             return
 
-        self.cursor.execute("SELECT image FROM face_images WHERE msv=?", (msv,))
-        images = self.cursor.fetchall()
+        # chỉ đọc ảnh thu nhỏ đã tính sẵn, không giải mã ảnh gốc
+        thumbnails = get_thumbnails(self.conn, msv, self.image_store)
 
-        if not images:
+        if not thumbnails:
             messagebox.showinfo("Thông báo", "Không có ảnh cho sinh viên này")
             return
 
@@ -312,9 +403,8 @@ class StudentManagementSystem:
         frame = ttk.Frame(canvas)
         canvas.create_window((0, 0), window=frame, anchor="nw")
 
-        for i, img_data in enumerate(images):
-            img = Image.open(io.BytesIO(img_data[0]))
-            img.thumbnail((200, 200))  # Resize image for thumbnail
+        for i, thumbnail in enumerate(thumbnails):
+            img = Image.open(io.BytesIO(thumbnail))
             photo = ImageTk.PhotoImage(img)
             label = ttk.Label(frame, image=photo)
             label.image = photo
@@ -333,24 +423,14 @@ class StudentManagementSystem:
         if not file_paths:
             return  # User canceled file selection
 
-        added_count = 0
-        for file_path in file_paths:
-            try:
-                with Image.open(file_path) as img:
-                    img.thumbnail((500, 500))
-                    img_byte_arr = io.BytesIO()
-                    img.save(img_byte_arr, format=img.format)
-                    img_byte_arr = img_byte_arr.getvalue()
-
-                self.cursor.execute("SELECT COUNT(*) FROM face_images WHERE msv=?", (msv,))
-                image_count = self.cursor.fetchone()[0]
-
-                self.cursor.execute("INSERT INTO face_images (msv, image_number, image) VALUES (?, ?, ?)",
-                                    (msv, image_count + 1, img_byte_arr))
-                self.conn.commit()
-                added_count += 1
-            except Exception as e:
-                messagebox.showerror("Lỗi", f"Không thể thêm ảnh {file_path}: {str(e)}")
+        # tất cả ảnh được thêm trong một transaction
+        try:
+            added_count, errors = add_images(self.conn, msv, file_paths, self.image_store)
+        except sqlite3.Error as e:
+            messagebox.showerror("Lỗi", f"Không thể thêm ảnh: {e}")
+            return
+        for file_path, e in errors:
+            messagebox.showerror("Lỗi", f"Không thể thêm ảnh {file_path}: {str(e)}")
 
         if added_count > 0:
             messagebox.showinfo("Thành công", f"Đã thêm {added_count} ảnh mới cho sinh viên")
@@ -358,6 +438,8 @@ class StudentManagementSystem:
             messagebox.showwarning("Cảnh báo", "Không có ảnh nào được thêm")
 
 
-root = tk.Tk()
-app = StudentManagementSystem(root)
-root.mainloop()
\ No newline at end of file
+# các tiến trình tiền xử lý khi train sẽ import lại module này, nên chỉ mở giao diện ở tiến trình chính
+if __name__ == '__main__':
+    root = tk.Tk()
+    app = StudentManagementSystem(root)
+    root.mainloop()
\ No newline at end of file
@@ -0,0 +1,95 @@
+import zlib
+
+import numpy as np
+
+
+# Chỉ mục IVF (inverted file) thuần NumPy cho histogram LBPH: các histogram được chia thành nlist cụm bằng k-means
+# trên sqrt(histogram) (khoảng cách Hellinger, gần với chi-square); khi tìm kiếm chỉ xét các histogram thuộc
+# nprobe cụm gần query nhất. nprobe lớn hơn -> chính xác hơn nhưng chậm hơn; nprobe = nlist giống tìm kiếm đầy đủ.
+class IVFIndex:
+    def __init__(self, centroids, list_offsets, list_rows, fingerprint='', nprobe=4):
+        self.centroids = centroids
+        # hàng của cụm c nằm trong list_rows[list_offsets[c]:list_offsets[c + 1]]
+        self.list_offsets = list_offsets
+        self.list_rows = list_rows
+        self.fingerprint = fingerprint
+        self.nprobe = nprobe
+        self._centroid_norms = (centroids * centroids).sum(axis=1)
+        # chỉ mục cũ có thể còn cụm rỗng: không bao giờ thăm các cụm đó
+        self._nonempty = np.flatnonzero(np.diff(list_offsets) > 0)
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, histograms, nlist=None, iterations=10, sample_per_list=64, seed=0, nprobe=4):
+        points = np.sqrt(np.asarray(histograms, dtype=np.float32))
+        num_rows = len(points)
+        if nlist is None:
+            nlist = int(round(np.sqrt(num_rows)))
+        nlist = max(1, min(nlist, num_rows))
+
+        # chỉ dùng một mẫu con để học tâm cụm, chi phí train không tăng theo kích thước mô hình
+        rng = np.random.default_rng(seed)
+        sample_size = min(num_rows, nlist * sample_per_list)
+        sample = points[rng.choice(num_rows, size=sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, size=nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = _nearest_centroid(sample, centroids)
+            for c in range(nlist):
+                members = sample[assignment == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+                else:
+                    # cụm rỗng: lấy lại một điểm ngẫu nhiên
+                    centroids[c] = sample[rng.integers(sample_size)]
+
+        assignment = _nearest_centroid(points, centroids)
+        list_rows = np.argsort(assignment, kind='stable').astype(np.int32)
+        counts = np.bincount(assignment, minlength=nlist)
+        # histogram trùng nhau cho ra tâm cụm trùng nhau và cụm rỗng: bỏ các cụm rỗng
+        # (thứ tự của list_rows không đổi vì cụm rỗng không có hàng nào)
+        centroids = centroids[counts > 0]
+        counts = counts[counts > 0]
+        list_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        return cls(centroids, list_offsets, list_rows, model_fingerprint(histograms), nprobe)
+
+    # các đoạn (start, stop) trong list_rows cần xét cho một query (đã lấy sqrt), cụm gần nhất trước
+    def probe(self, sqrt_query, nprobe=None):
+        candidates = self._nonempty
+        nprobe = min(nprobe or self.nprobe, len(candidates))
+        if nprobe == 0:
+            return []
+        dist = self._centroid_norms[candidates] - 2 * (self.centroids[candidates] @ sqrt_query)
+        order = np.argpartition(dist, nprobe - 1)[:nprobe] if nprobe < len(candidates) else np.arange(len(candidates))
+        probes = candidates[order[np.argsort(dist[order])]]
+        return [(self.list_offsets[c], self.list_offsets[c + 1]) for c in probes]
+
+    def save(self, path):
+        with open(path, 'wb') as file:
+            np.savez(file, centroids=self.centroids, list_offsets=self.list_offsets, list_rows=self.list_rows,
+                     fingerprint=np.array(self.fingerprint))
+
+    @classmethod
+    def load(cls, path, nprobe=4):
+        with np.load(path) as data:
+            return cls(data['centroids'], data['list_offsets'], data['list_rows'], str(data['fingerprint']), nprobe)
+
+
+def _nearest_centroid(points, centroids, block=4096):
+    norms = (centroids * centroids).sum(axis=1)
+    assignment = np.empty(len(points), dtype=np.int64)
+    for start in range(0, len(points), block):
+        dist = norms[None, :] - 2 * (points[start:start + block] @ centroids.T)
+        assignment[start:start + block] = dist.argmin(axis=1)
+    return assignment
+
+
+# dấu vân tay rẻ của mô hình để biết chỉ mục có được xây từ đúng mô hình này không
+def model_fingerprint(histograms):
+    histograms = np.asarray(histograms, dtype=np.float32)
+    step = max(1, len(histograms) // 64)
+    sampled = np.ascontiguousarray(histograms[::step])
+    return f"{histograms.shape[0]}x{histograms.shape[1] if histograms.ndim == 2 else 0}:" \
+           f"{zlib.crc32(sampled.tobytes()):08x}"
@@ -0,0 +1,146 @@
+import queue
+import sqlite3
+import threading
+import time
+
+
+def create_attendance_table(cursor):
+    cursor.execute('''CREATE TABLE IF NOT EXISTS attendance
+                      (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                       msv TEXT,
+                       session TEXT,
+                       checked_at TEXT,
+                       confidence REAL,
+                       FOREIGN KEY(msv) REFERENCES students(msv))''')
+    # mỗi sinh viên chỉ có một bản ghi cho mỗi buổi
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_attendance_msv_session ON attendance(msv, session)")
+
+
+# Bộ lọc trong bộ nhớ: mỗi sinh viên chỉ được ghi một lần cho mỗi buổi, các lần nhận diện sau bị bỏ qua
+# mà không phải chạm tới cơ sở dữ liệu.
+class Debouncer:
+    def __init__(self, seen=()):
+        self.seen = set(seen)
+        self.lock = threading.Lock()
+
+    def should_record(self, key):
+        with self.lock:
+            if key in self.seen:
+                return False
+            self.seen.add(key)
+            return True
+
+    # bỏ đánh dấu các khóa chưa ghi được để lần nhận diện sau ghi lại
+    def forget(self, keys):
+        with self.lock:
+            self.seen.difference_update(keys)
+
+    def distinct(self, part):
+        with self.lock:
+            return len({key[part] for key in self.seen})
+
+    def __len__(self):
+        return len(self.seen)
+
+
+# ký tự đặc biệt của GLOB được đặt trong [] để so khớp đúng nguyên văn
+def _glob_escape(text):
+    return ''.join(f'[{char}]' if char in '*?[' else char for char in text)
+
+
+# Ghi điểm danh: record() được gọi từ luồng nhận diện và chỉ đưa bản ghi vào hàng đợi; một luồng ghi riêng
+# gom các bản ghi và chèn chúng trong một transaction cho mỗi lần flush. Cơ sở dữ liệu ở chế độ WAL nên
+# giao diện vẫn đọc được trong lúc ghi.
+class AttendanceRecorder:
+    # session: tên buổi (mặc định là ngày hôm nay); window (giây): nếu có, buổi được chia thành các khung
+    # thời gian và mỗi sinh viên được ghi một lần trong mỗi khung
+    def __init__(self, db_path, session=None, window=None, min_confidence=0, flush_interval=1.0,
+                 batch_size=100, max_retries=5):
+        self.session = session or time.strftime('%Y-%m-%d')
+        self.window = window
+        self.min_confidence = min_confidence
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+
+        # kết nối chỉ được luồng ghi dùng sau khi khởi tạo xong
+        self.conn = sqlite3.connect(db_path, timeout=10, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        create_attendance_table(self.conn.cursor())
+        self.conn.commit()
+        # những sinh viên đã được ghi trong buổi này (ví dụ trước khi mở lại ứng dụng) không bị ghi lại
+        # (chỉ đúng buổi này và các khung thời gian "<buổi> HH:MM" của nó, không lấy buổi khác cùng tiền tố)
+        rows = self.conn.execute("SELECT msv, session FROM attendance WHERE session = ? OR session GLOB ?",
+                                 (self.session, _glob_escape(self.session) + ' [0-9][0-9]:[0-9][0-9]')).fetchall()
+        self.debouncer = Debouncer(rows)
+
+        self.pending = queue.Queue()
+        self.written = 0
+        self.running = True
+        self.thread = threading.Thread(target=self._writer, daemon=True)
+        self.thread.start()
+
+    def session_key(self, now):
+        if not self.window:
+            return self.session
+        return f"{self.session} {time.strftime('%H:%M', time.localtime(now // self.window * self.window))}"
+
+    def record(self, msv, confidence_value):
+        if msv is None or confidence_value < self.min_confidence:
+            return False
+        now = time.time()
+        session = self.session_key(now)
+        if not self.debouncer.should_record((msv, session)):
+            return False
+        checked_at = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(now))
+        self.pending.put((msv, session, checked_at, confidence_value))
+        return True
+
+    # số sinh viên đã điểm danh trong buổi (mỗi sinh viên tính một lần dù có nhiều khung thời gian)
+    def count(self):
+        return self.debouncer.distinct(0)
+
+    # lô ghi lỗi (ví dụ "database is locked") được giữ lại và ghi lại ở lần flush sau; nếu vẫn lỗi sau
+    # max_retries lần thì bỏ đánh dấu để sinh viên được ghi lại khi được nhận diện lần nữa
+    def _writer(self):
+        failed, attempts = [], 0
+        while self.running or failed or not self.pending.empty():
+            batch, failed = failed, []
+            try:
+                batch.append(self.pending.get(timeout=self.flush_interval))
+                while len(batch) < self.batch_size:
+                    batch.append(self.pending.get_nowait())
+            except queue.Empty:
+                pass
+            if not batch:
+                continue
+            if self._flush(batch):
+                attempts = 0
+                continue
+            attempts += 1
+            if attempts < self.max_retries:
+                failed = batch
+            else:
+                self.debouncer.forget((msv, session) for msv, session, _, _ in batch)
+                print(f"Dropped {len(batch)} attendance records after {attempts} attempts")
+                attempts = 0
+
+    def _flush(self, batch):
+        try:
+            with self.conn:
+                self.conn.executemany('''INSERT OR IGNORE INTO attendance (msv, session, checked_at, confidence)
+                                         VALUES (?, ?, ?, ?)''', batch)
+            self.written += len(batch)
+            return True
+        except sqlite3.Error as e:
+            print(f"Error writing attendance: {e}")
+            return False
+
+    # ghi nốt các bản ghi còn trong hàng đợi rồi đóng kết nối
+    def close(self):
+        if not self.running:
+            return
+        self.running = False
+        self.thread.join()
+        self.conn.close()
@@ -0,0 +1,94 @@
+import cv2
+import numpy as np
+
+from .Matcher import chi_square
+
+
+# Chuẩn hóa khuôn mặt trước khi tính histogram: đưa về kích thước cố định và cân bằng histogram độ sáng.
+# Tham số được lưu trong mô hình để lúc nhận diện áp dụng đúng cách chuẩn hóa như lúc train.
+class FaceNormalization:
+    def __init__(self, size=(100, 100), equalize=True):
+        self.size = tuple(int(v) for v in size)
+        self.equalize = bool(equalize)
+
+    def apply(self, face):
+        if face.shape[1] != self.size[0] or face.shape[0] != self.size[1]:
+            shrink = face.shape[1] > self.size[0]
+            face = cv2.resize(face, self.size, interpolation=cv2.INTER_AREA if shrink else cv2.INTER_LINEAR)
+        if self.equalize:
+            face = cv2.equalizeHist(face)
+        return face
+
+    def to_dict(self):
+        return {'size': list(self.size), 'equalize': self.equalize}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['size'], data['equalize']) if data else None
+
+    def __eq__(self, other):
+        return isinstance(other, FaceNormalization) and self.to_dict() == other.to_dict()
+
+
+# Các biến thể rẻ của một khuôn mặt: lật ngang, xoay nhẹ, phóng to nhẹ (như khung phát hiện lệch) và làm mờ.
+# Thay đổi độ sáng không có ích vì LBP và equalizeHist đã không phụ thuộc vào độ sáng.
+def augmentations(face):
+    height, width = face.shape[:2]
+    center = (width / 2, height / 2)
+    variants = [cv2.flip(face, 1)]
+    for angle in (8, -8):
+        rotation = cv2.getRotationMatrix2D(center, angle, 1.0)
+        variants.append(cv2.warpAffine(face, rotation, (width, height), borderMode=cv2.BORDER_REPLICATE))
+    zoom = cv2.getRotationMatrix2D(center, 0, 1.1)
+    variants.append(cv2.warpAffine(face, zoom, (width, height), borderMode=cv2.BORDER_REPLICATE))
+    variants.append(cv2.GaussianBlur(face, (3, 3), 0))
+    return variants
+
+
+# chọn `budget` mẫu khác nhau nhất (lấy mẫu xa nhất theo khoảng cách chi-square giữa các histogram LBP):
+# bắt đầu từ mẫu gần trung bình nhất, mỗi bước thêm mẫu xa nhất so với các mẫu đã chọn; ảnh trùng bị bỏ trước
+def select_diverse(histograms, budget):
+    if len(histograms) <= budget:
+        return list(range(len(histograms)))
+    if budget <= 0:
+        return []
+    histograms = np.asarray(histograms, dtype=np.float32)
+    chosen = [int(np.argmin(chi_square(histograms.mean(axis=0), histograms)))]
+    min_dist = chi_square(histograms[chosen[0]], histograms)
+    # mẫu đã chọn được đánh dấu -1 để không bị chọn lại khi các mẫu còn lại đều trùng với mẫu đã chọn
+    min_dist[chosen[0]] = -1
+    while len(chosen) < budget:
+        i = int(np.argmax(min_dist))
+        chosen.append(i)
+        np.minimum(min_dist, chi_square(histograms[i], histograms), out=min_dist)
+        min_dist[i] = -1
+    return sorted(chosen)
+
+
+# Chuẩn bị khuôn mặt để train: chuẩn hóa, giới hạn mỗi sinh viên tối đa max_per_student mẫu khác nhau nhất và
+# sinh thêm biến thể cho sinh viên có ít hơn min_per_student mẫu.
+# histogram(face): histogram LBP dùng để đo độ khác nhau; existing: nhãn -> số mẫu đã có trong mô hình (khi update)
+def prepare_training_faces(faces, labels, histogram, normalization=None, max_per_student=None,
+                           min_per_student=0, existing=None):
+    existing = existing or {}
+    groups = {}
+    for face, label in zip(faces, labels):
+        groups.setdefault(label, []).append(normalization.apply(face) if normalization is not None else face)
+
+    prepared = []
+    prepared_labels = []
+    for label, group in groups.items():
+        have = existing.get(label, 0)
+        if max_per_student is not None and have + len(group) > max_per_student:
+            keep = select_diverse(np.vstack([histogram(face) for face in group]), max_per_student - have)
+            group = [group[i] for i in keep]
+        missing = min_per_student - have - len(group)
+        if missing > 0 and group:
+            # lần lượt từng biến thể của từng ảnh, để các ảnh gốc được dùng đều nhau
+            variants = [augmentations(face) for face in group]
+            extra = [variants[i % len(group)][i // len(group)]
+                     for i in range(min(missing, len(group) * len(variants[0])))]
+            group = group + extra
+        prepared.extend(group)
+        prepared_labels.extend([label] * len(group))
+    return prepared, prepared_labels
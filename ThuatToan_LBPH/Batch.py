@@ -0,0 +1,221 @@
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import time
+
+import cv2
+
+from .Detector import DetectionConfig
+from .Recognize import FaceRecognizer, model_version
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif')
+
+
+# Nhận diện hàng loạt cho video đã ghi hoặc thư mục ảnh: chia nguồn thành các đoạn, xử lý song song bằng
+# process pool (bỏ qua khung hình theo `every`), ghi kết quả từng đoạn ra file riêng để có thể chạy tiếp
+# sau khi bị ngắt, rồi gộp thành dòng thời gian xuất hiện của từng sinh viên (theo msv).
+
+def list_images(folder):
+    return sorted(os.path.join(folder, name) for name in os.listdir(folder)
+                  if name.lower().endswith(IMAGE_EXTENSIONS))
+
+
+# (số khung hình, fps) của nguồn; thư mục ảnh coi mỗi ảnh là một khung hình
+def source_info(source, image_fps=1.0):
+    if os.path.isdir(source):
+        return len(list_images(source)), image_fps
+    capture = cv2.VideoCapture(source)
+    try:
+        if not capture.isOpened():
+            raise IOError(f"Cannot open video {source}")
+        return int(capture.get(cv2.CAP_PROP_FRAME_COUNT)), capture.get(cv2.CAP_PROP_FPS) or 25.0
+    finally:
+        capture.release()
+
+
+# mỗi tiến trình con nạp mô hình một lần (đọc cả bản nhị phân vào bộ nhớ, xem FaceRecognizer._load_snapshot)
+_worker_recognizer = None
+
+
+def _init_worker(db_path, detection):
+    global _worker_recognizer
+    conn = sqlite3.connect(db_path)
+    try:
+        _worker_recognizer = FaceRecognizer(conn.cursor(), detection=detection)
+    finally:
+        conn.close()
+
+
+def _iter_segment_frames(source, start, stop, every):
+    # chỉ lấy các khung hình có chỉ số chia hết cho every
+    first = (start + every - 1) // every * every
+    if os.path.isdir(source):
+        images = list_images(source)
+        for index in range(first, stop, every):
+            frame = cv2.imread(images[index])
+            if frame is not None:
+                yield index, frame
+        return
+    capture = cv2.VideoCapture(source)
+    try:
+        capture.set(cv2.CAP_PROP_POS_FRAMES, first)
+        index = first
+        while index < stop:
+            ret, frame = capture.read()
+            if not ret:
+                break
+            yield index, frame
+            # khung hình bị bỏ qua chỉ cần grab, không phải giải mã
+            for _ in range(every - 1):
+                index += 1
+                if index >= stop or not capture.grab():
+                    return
+            index += 1
+    finally:
+        capture.release()
+
+
+def _process_segment(task):
+    source, start, stop, every, fps, part_path = task
+    recognizer = _worker_recognizer
+    sightings = []
+    frames = 0
+    for index, frame in _iter_segment_frames(source, start, stop, every):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        faces = recognizer.detect_faces(gray)
+        for id, confidence_value in recognizer.identify_faces(gray, faces):
+            if id != -1:
+                sightings.append([recognizer.msv_of(id), recognizer.name_of(id), round(index / fps, 3),
+                                  confidence_value])
+        frames += 1
+    part = {'start': start, 'stop': stop, 'frames': frames, 'sightings': sightings}
+    # ghi file tạm rồi đổi tên, để một đoạn ghi dở không bị coi là đã xong
+    with open(part_path + '.tmp', 'w', encoding='utf-8') as file:
+        json.dump(part, file)
+    os.replace(part_path + '.tmp', part_path)
+    return frames
+
+
+# gộp các lần xuất hiện thành các khoảng liên tục (cách nhau không quá max_gap giây), theo từng msv
+def build_timeline(sightings, max_gap):
+    timeline = {}
+    for msv, name, seconds, confidence in sorted(sightings, key=lambda item: (item[0], item[2])):
+        intervals = timeline.setdefault(msv, {'name': name, 'intervals': []})['intervals']
+        if intervals and seconds - intervals[-1]['end'] <= max_gap:
+            interval = intervals[-1]
+            interval['end'] = seconds
+            interval['sightings'] += 1
+            interval['confidence_sum'] += confidence
+            interval['max_confidence'] = max(interval['max_confidence'], confidence)
+        else:
+            intervals.append({'start': seconds, 'end': seconds, 'sightings': 1,
+                              'confidence_sum': confidence, 'max_confidence': confidence})
+    for student in timeline.values():
+        for interval in student['intervals']:
+            interval['mean_confidence'] = round(interval.pop('confidence_sum') / interval['sightings'], 2)
+    return timeline
+
+
+def run_batch(source, output, db_path='students.db', every=5, segment_frames=300, workers=None,
+              detection=None, max_gap=None, image_fps=1.0):
+    workers = workers or os.cpu_count() or 1
+    detection = detection or DetectionConfig()
+    total_frames, fps = source_info(source, image_fps)
+    if max_gap is None:
+        # mặc định: bỏ lỡ tối đa 3 lần lấy mẫu liên tiếp vẫn tính là cùng một lần xuất hiện
+        max_gap = 3 * every / fps
+
+    parts_dir = output + '.parts'
+    manifest_path = os.path.join(parts_dir, 'manifest.json')
+    # các đoạn của lần chạy trước chỉ dùng lại được nếu cùng nguồn, cùng tham số và cùng mô hình
+    manifest = json.loads(json.dumps({
+        'source': os.path.abspath(source),
+        'total_frames': total_frames,
+        'every': every,
+        'segment_frames': segment_frames,
+        'image_fps': image_fps,
+        'detection': detection.signature(),
+        'model_version': model_version(),
+    }))
+    if os.path.isdir(parts_dir):
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as file:
+                previous = json.load(file)
+        except (OSError, ValueError):
+            previous = None
+        if previous != manifest:
+            print("[INFO] Discarding segments from a run with different parameters or model")
+            shutil.rmtree(parts_dir)
+    if not os.path.isdir(parts_dir):
+        os.makedirs(parts_dir)
+        with open(manifest_path, 'w', encoding='utf-8') as file:
+            json.dump(manifest, file)
+    tasks = []
+    for number, start in enumerate(range(0, total_frames, segment_frames)):
+        part_path = os.path.join(parts_dir, f"segment_{number:05d}.json")
+        # đoạn đã có kết quả từ lần chạy trước thì bỏ qua
+        if not os.path.exists(part_path):
+            tasks.append((source, start, min(start + segment_frames, total_frames), every, fps, part_path))
+    done = (total_frames + segment_frames - 1) // segment_frames - len(tasks)
+    if done:
+        print(f"[INFO] Resuming: {done} segments already processed")
+
+    started = time.perf_counter()
+    processed = 0
+    if tasks:
+        with multiprocessing.Pool(min(workers, len(tasks)), initializer=_init_worker,
+                                  initargs=(db_path, detection)) as pool:
+            for frames in pool.imap_unordered(_process_segment, tasks):
+                processed += frames
+    elapsed = time.perf_counter() - started
+
+    sightings = []
+    frames = 0
+    for name in sorted(os.listdir(parts_dir)):
+        if name.startswith('segment_') and name.endswith('.json'):
+            with open(os.path.join(parts_dir, name), 'r', encoding='utf-8') as file:
+                part = json.load(file)
+            sightings.extend(part['sightings'])
+            frames += part['frames']
+
+    result = {
+        'source': source,
+        'fps': fps,
+        'total_frames': total_frames,
+        'every': every,
+        'frames_processed': frames,
+        'students': build_timeline(sightings, max_gap),
+    }
+    with open(output + '.tmp', 'w', encoding='utf-8') as file:
+        json.dump(result, file, ensure_ascii=False, indent=2)
+    os.replace(output + '.tmp', output)
+    shutil.rmtree(parts_dir)
+
+    throughput = processed / elapsed if elapsed > 0 else 0.0
+    print(f"[INFO] {processed} frames processed in {elapsed:.1f}s ({throughput:.1f} frames/sec), "
+          f"{len(result['students'])} students found -> {output}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Nhận diện hàng loạt cho video đã ghi hoặc thư mục ảnh")
+    parser.add_argument('source', help="file video hoặc thư mục ảnh")
+    parser.add_argument('output', help="file JSON dòng thời gian")
+    parser.add_argument('--db', default='students.db')
+    parser.add_argument('--every', type=int, default=5, help="chỉ xử lý 1 trong mỗi N khung hình")
+    parser.add_argument('--segment-frames', type=int, default=300)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--downscale', type=float, default=1.0)
+    parser.add_argument('--max-gap', type=float, default=None, help="khoảng cách tối đa (giây) giữa hai lần thấy")
+    parser.add_argument('--image-fps', type=float, default=1.0, help="số ảnh mỗi giây khi nguồn là thư mục ảnh")
+    args = parser.parse_args()
+
+    run_batch(args.source, args.output, args.db, args.every, args.segment_frames, args.workers,
+              DetectionConfig(downscale=args.downscale), args.max_gap, args.image_fps)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,453 @@
+import argparse
+import io
+import json
+import os
+import platform
+import sqlite3
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from . import Timing
+from .AnnIndex import IVFIndex
+from .Detector import DetectionConfig, FaceDetector
+from .FaceCache import FaceCache
+from .Matcher import HistogramMatcher
+from .ModelStore import LBPHModel
+from .Recognize import FaceRecognizer, ModelSnapshot
+from .Storage import FileImageStore, create_student_tables, get_thumbnails, import_dataset, list_dataset
+from .Train import (TRAIN_DETECTION, TRAIN_NORMALIZATION, create_recognizer, detect_faces,
+                    get_images_from_dataset, image_key, iter_images_from_dataset, load_detector, preprocess_images,
+                    train_face_recognizer)
+
+DATASET_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'dataset')
+RESULTS_PATH = 'bench_results.json'
+# giống CAMERA_DETECTION trong Main.py
+CAMERA_DETECTION = DetectionConfig(downscale=2.0)
+
+
+# đo tốc độ tiền xử lý (ảnh/giây) với số tiến trình khác nhau, không dùng cache
+def benchmark_preprocessing(dataset_path=DATASET_PATH, worker_counts=None):
+    items = [(image_key(img_data), img_data) for _, img_data in get_images_from_dataset(dataset_path)]
+    if worker_counts is None:
+        worker_counts = sorted({1, 2, 4, os.cpu_count() or 1})
+
+    results = {}
+    reference = None
+    for workers in worker_counts:
+        start = time.perf_counter()
+        output = preprocess_images(items, workers=workers)
+        elapsed = time.perf_counter() - start
+        results[workers] = len(items) / elapsed
+        print(f"[BENCH] preprocess workers={workers}: {len(items)} images in {elapsed:.2f}s "
+              f"({results[workers]:.1f} images/sec)")
+
+        # kết quả song song phải giống hệt kết quả chạy tuần tự
+        if reference is None:
+            reference = output
+        elif not _same_faces(reference, output):
+            raise AssertionError(f"workers={workers} produced different faces than workers={worker_counts[0]}")
+    return results
+
+
+def _same_faces(a, b):
+    if [key for key, _ in a] != [key for key, _ in b]:
+        return False
+    for (_, faces_a), (_, faces_b) in zip(a, b):
+        if len(faces_a) != len(faces_b):
+            return False
+        if not all(np.array_equal(fa, fb) for fa, fb in zip(faces_a, faces_b)):
+            return False
+    return True
+
+
+# lấy khuôn mặt thật từ dataset làm dữ liệu mẫu
+def sample_faces(dataset_path=DATASET_PATH, limit=20):
+    detector = load_detector()
+    faces = []
+    for _, img_data in iter_images_from_dataset(dataset_path):
+        faces.extend(detect_faces(detector, img_data)[0])
+        if len(faces) >= limit:
+            break
+    return faces[:limit]
+
+
+# mọi khuôn mặt trong dataset kèm tên thư mục, phát hiện như lúc train nhưng với cache khuôn mặt tạm,
+# không đụng tới trainer/
+def dataset_faces(dataset_path=DATASET_PATH):
+    faces = []
+    ids = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache = FaceCache(os.path.join(tmp_dir, 'face_cache.db'), TRAIN_DETECTION.signature())
+        try:
+            for person, img_data in iter_images_from_dataset(dataset_path):
+                for _, key_faces in preprocess_images([(image_key(img_data), img_data)], cache):
+                    faces.extend(key_faces)
+                    ids.extend([person] * len(key_faces))
+        finally:
+            cache.close()
+    return faces, ids
+
+
+# mô hình được train trên khuôn mặt đã chuẩn hóa như mô hình thật; model.histogram() chuẩn hóa query theo cùng
+# cách nên query có thể là khuôn mặt thô
+def _normalized_model(images, labels):
+    recognizer = create_recognizer()
+    recognizer.train([TRAIN_NORMALIZATION.apply(img) for img in images], labels)
+    return LBPHModel.from_recognizer(recognizer, TRAIN_NORMALIZATION)
+
+
+# tạo danh sách sinh viên giả lập từ khuôn mặt thật: mỗi sinh viên là một tổ hợp ngẫu nhiên của hai khuôn mặt
+# (có thể lật ngang, đổi độ tương phản), mỗi ảnh của sinh viên đó bị dịch, cắt và thêm nhiễu
+def synthetic_roster(faces, num_students, images_per_student, size=64, seed=0):
+    rng = np.random.default_rng(seed)
+    bases = [cv2.resize(face, (size + 8, size + 8)).astype(np.float32) for face in faces]
+    images = []
+    labels = []
+    for student in range(num_students):
+        first, second = rng.choice(len(bases), size=2, replace=len(bases) < 2)
+        weight = rng.uniform(0.2, 0.8)
+        face = weight * bases[first] + (1 - weight) * bases[second][:, ::-1 if rng.random() < 0.5 else 1]
+        face = (face - face.mean()) * rng.uniform(0.7, 1.3) + face.mean()
+        for _ in range(images_per_student):
+            dx, dy = rng.integers(0, 9, size=2)
+            img = face[dy:dy + size, dx:dx + size] + rng.normal(0, 4, (size, size))
+            images.append(np.clip(img, 0, 255).astype(np.uint8))
+            labels.append(student)
+    return images, np.array(labels, dtype=np.int32)
+
+
+# so sánh recognizer.predict (từng khuôn mặt) với HistogramMatcher (cả khung hình một lần)
+def benchmark_matcher(student_counts=(100, 1000, 10000), images_per_student=3, faces_per_frame=8,
+                      repeats=5, dataset_path=DATASET_PATH):
+    faces = sample_faces(dataset_path)
+    results = {}
+    for num_students in student_counts:
+        # mỗi sinh viên có thêm một ảnh không dùng để train; khung hình thử gồm ảnh giữ lại của vài sinh viên
+        images, labels = synthetic_roster(faces, num_students, images_per_student + 1)
+        held_out = np.arange(images_per_student, len(images), images_per_student + 1)
+        frame = [images[i] for i in held_out[:faces_per_frame]]
+        truth = labels[held_out[:faces_per_frame]]
+        keep = np.ones(len(images), dtype=bool)
+        keep[held_out] = False
+        images = [img for img, kept in zip(images, keep) if kept]
+        labels = labels[keep]
+        recognizer = create_recognizer()
+        recognizer.train(images, labels)
+        model = LBPHModel.from_recognizer(recognizer)
+        del images
+
+        start = time.perf_counter()
+        for _ in range(repeats):
+            expected = [recognizer.predict(face)[0] for face in frame]
+        predict_ms = (time.perf_counter() - start) * 1000 / repeats
+
+        row = {'predict_ms': predict_ms, 'predict_accuracy': float(np.mean(np.asarray(expected) == truth))}
+        for name, matcher in [('matcher', HistogramMatcher.from_model(model)),
+                              ('prototypes', HistogramMatcher.from_model(model, prototypes=True))]:
+            start = time.perf_counter()
+            for _ in range(repeats):
+                queries = np.vstack([model.histogram(face) for face in frame])
+                found, _ = matcher.match(queries)
+            row[name + '_ms'] = (time.perf_counter() - start) * 1000 / repeats
+            row[name + '_agreement'] = float(np.mean(np.asarray(expected) == found))
+            row[name + '_accuracy'] = float(np.mean(truth == found))
+        results[num_students] = row
+        print(f"[BENCH] match students={num_students} histograms={len(model)} faces/frame={len(frame)}: "
+              f"predict {row['predict_ms']:.1f} ms/frame (accuracy {row['predict_accuracy']:.0%}), "
+              f"matcher {row['matcher_ms']:.1f} ms/frame (agreement {row['matcher_agreement']:.0%}), "
+              f"prototypes {row['prototypes_ms']:.1f} ms/frame (accuracy {row['prototypes_accuracy']:.0%})")
+    return results
+
+
+# độ phủ (recall) của chỉ mục IVF so với tìm kiếm chính xác: tỉ lệ khuôn mặt được gán cùng nhãn và khoảng cách
+def _ann_recall(model, queries, nprobes, repeats=3):
+    exact = HistogramMatcher.from_model(model)
+    index = IVFIndex.build(model.histograms)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        exact_labels, exact_dist = exact.match(queries)
+    rows = [{'nprobe': 0, 'ms': (time.perf_counter() - start) * 1000 / repeats, 'recall': 1.0}]
+    for nprobe in nprobes:
+        if nprobe > index.nlist:
+            continue
+        index.nprobe = nprobe
+        approx = HistogramMatcher.from_model(model, index=index)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            labels, dist = approx.match(queries)
+        hits = (labels == exact_labels) & np.isclose(dist, exact_dist)
+        rows.append({'nprobe': nprobe, 'ms': (time.perf_counter() - start) * 1000 / repeats,
+                     'recall': float(hits.mean())})
+    return index.nlist, rows
+
+
+# recall và tốc độ của chỉ mục IVF: trên dataset có sẵn (1/4 số khuôn mặt làm query) và trên danh sách giả lập
+def benchmark_ann(dataset_path=DATASET_PATH, num_students=10000, images_per_student=3,
+                  nprobes=(1, 2, 4, 8, 16, 32)):
+    faces, ids = dataset_faces(dataset_path)
+    names = sorted(set(ids))
+    labels = np.array([names.index(person) for person in ids], dtype=np.int32)
+    is_query = np.arange(len(faces)) % 4 == 0
+    model = _normalized_model([face for face, query in zip(faces, is_query) if not query], labels[~is_query])
+    queries = np.vstack([model.histogram(face) for face, query in zip(faces, is_query) if query])
+
+    results = {}
+    for name, (model, queries) in [('dataset', (model, queries)),
+                                   ('synthetic', _synthetic_model(faces, num_students, images_per_student))]:
+        nlist, rows = _ann_recall(model, queries, nprobes)
+        results[name] = {'histograms': len(model), 'nlist': nlist, 'queries': len(queries), 'runs': rows}
+        for row in rows:
+            mode = 'exact' if row['nprobe'] == 0 else f"nprobe={row['nprobe']}"
+            print(f"[BENCH] ann {name} histograms={len(model)} nlist={nlist} {mode}: "
+                  f"{row['ms']:.1f} ms/{len(queries)} faces, recall {row['recall']:.1%}")
+    return results
+
+
+def _synthetic_model(faces, num_students, images_per_student, num_queries=64):
+    images, labels = synthetic_roster(faces, num_students, images_per_student + 1)
+    held_out = np.arange(images_per_student, len(images), images_per_student + 1)
+    keep = np.ones(len(images), dtype=bool)
+    keep[held_out] = False
+    model = _normalized_model([img for img, kept in zip(images, keep) if kept], labels[keep])
+    queries = np.vstack([model.histogram(images[i]) for i in held_out[:num_queries]])
+    return model, queries
+
+
+# nhập dataset vào một cơ sở dữ liệu mới: cách cũ của add_image (mỗi ảnh một COUNT và một commit, không chỉ mục,
+# thumbnail tính lúc xem) so với import_dataset (song song, một transaction, thumbnail tính sẵn)
+def benchmark_import(dataset_path=DATASET_PATH, worker_counts=None):
+    items = list_dataset(dataset_path)
+    msvs = sorted({msv for msv, _ in items})
+    if worker_counts is None:
+        worker_counts = sorted({1, os.cpu_count() or 1})
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        conn = sqlite3.connect(os.path.join(tmp_dir, 'before.db'))
+        conn.execute("CREATE TABLE face_images (id INTEGER PRIMARY KEY AUTOINCREMENT, msv TEXT, "
+                     "image_number INTEGER, image BLOB)")
+        start = time.perf_counter()
+        for msv, path in items:
+            with Image.open(path) as img:
+                img.thumbnail((500, 500))
+                buffer = io.BytesIO()
+                img.save(buffer, format=img.format)
+            image_count = conn.execute("SELECT COUNT(*) FROM face_images WHERE msv=?", (msv,)).fetchone()[0]
+            conn.execute("INSERT INTO face_images (msv, image_number, image) VALUES (?, ?, ?)",
+                         (msv, image_count + 1, buffer.getvalue()))
+            conn.commit()
+        import_elapsed = time.perf_counter() - start
+        start = time.perf_counter()
+        for msv in msvs:
+            for (image,) in conn.execute("SELECT image FROM face_images WHERE msv=?", (msv,)):
+                Image.open(io.BytesIO(image)).thumbnail((200, 200))
+        view_elapsed = time.perf_counter() - start
+        conn.close()
+        print(f"[BENCH] import before: {len(items)} images in {import_elapsed:.2f}s "
+              f"({len(items) / import_elapsed:.1f} images/sec), view all {view_elapsed * 1000:.0f} ms")
+
+        results = {'before': len(items) / import_elapsed}
+        for workers in worker_counts:
+            conn = sqlite3.connect(os.path.join(tmp_dir, f'after_{workers}.db'))
+            create_student_tables(conn.cursor())
+            store = FileImageStore(os.path.join(tmp_dir, f'images_{workers}'))
+            start = time.perf_counter()
+            added, _ = import_dataset(conn, dataset_path, store, workers)
+            import_elapsed = time.perf_counter() - start
+            start = time.perf_counter()
+            for msv in msvs:
+                for thumbnail in get_thumbnails(conn, msv, store):
+                    Image.open(io.BytesIO(thumbnail)).load()
+            view_elapsed = time.perf_counter() - start
+            conn.close()
+            results[workers] = added / import_elapsed
+            print(f"[BENCH] import after workers={workers}: {added} images in {import_elapsed:.2f}s "
+                  f"({results[workers]:.1f} images/sec), view all {view_elapsed * 1000:.0f} ms")
+    return results
+
+
+# bộ nhớ tối đa của tiến trình (MB); None nếu hệ điều hành không có module resource (Windows)
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS trả về byte, Linux trả về KB
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def dataset_frames(dataset_path=DATASET_PATH, limit=20):
+    frames = []
+    for _, img_data in iter_images_from_dataset(dataset_path):
+        frame = cv2.imdecode(np.frombuffer(img_data, np.uint8), cv2.IMREAD_COLOR)
+        if frame is not None:
+            frames.append(frame)
+        if len(frames) >= limit:
+            break
+    return frames
+
+
+def _time_ms(function, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        function()
+    return (time.perf_counter() - start) * 1000 / repeats
+
+
+# Bộ benchmark đầy đủ chạy offline trên dataset và danh sách sinh viên giả lập: phát hiện (ms/khung hình),
+# nhận diện (ms/khuôn mặt), FPS từ đầu đến cuối, tốc độ train (ảnh/giây), thời gian nạp mô hình và bộ nhớ tối đa.
+# Kết quả (kèm số liệu của các timing hook) được ghi ra file JSON để so sánh giữa các lần thay đổi.
+def run_suite(dataset_path=DATASET_PATH, student_counts=(100, 1000), output=RESULTS_PATH, repeats=3,
+              faces_per_frame=8):
+    Timing.reset()
+    Timing.enable()
+    results = {}
+    frames = dataset_frames(dataset_path)
+    grays = [cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) for frame in frames]
+
+    # phát hiện khuôn mặt
+    results['detection'] = {}
+    for name, config in [('default', DetectionConfig()), ('camera', CAMERA_DETECTION)]:
+        detector = FaceDetector(config)
+        ms = _time_ms(lambda: [detector.detect(gray) for gray in grays], repeats) / len(grays)
+        results['detection'][name] = {'ms_per_frame': ms}
+        print(f"[BENCH] detect {name}: {ms:.1f} ms/frame ({len(grays)} frames)")
+
+    # train: chạy đúng train_face_recognizer (cache khuôn mặt, bảng nhãn, chuẩn hóa, ghi mô hình) nhưng với
+    # thư mục mô hình và cache tạm, không đụng tới mô hình trong trainer/; cache bắt đầu rỗng
+    dataset = get_images_from_dataset(dataset_path)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        start = time.perf_counter()
+        persons = train_face_recognizer(dataset, cache_path=os.path.join(tmp_dir, 'face_cache.db'),
+                                        trainer_dir=tmp_dir)
+        train_s = time.perf_counter() - start
+    stages = Timing.report()
+    results['training'] = {'images': len(dataset), 'persons': persons,
+                           'faces': stages.get('train_fit', {}).get('items', 0),
+                           'images_per_sec': len(dataset) / train_s}
+    for stage in ('train_preprocess', 'train_fit', 'train_save'):
+        results['training'][stage + '_s'] = stages.get(stage, {}).get('avg_ms', 0.0) / 1000
+    del dataset
+    print(f"[BENCH] train: {results['training']['images']} images in {train_s:.2f}s "
+          f"({results['training']['images_per_sec']:.1f} images/sec, "
+          f"preprocess {results['training']['train_preprocess_s']:.2f}s, "
+          f"fit {results['training']['train_fit_s']:.2f}s, save {results['training']['train_save_s']:.2f}s)")
+
+    # nhận diện trên danh sách giả lập với các kích thước khác nhau
+    conn = sqlite3.connect(':memory:')
+    conn.execute("CREATE TABLE students (msv TEXT PRIMARY KEY, name TEXT, birthdate TEXT, class TEXT)")
+    face_recognizer = FaceRecognizer(conn.cursor(), detection=CAMERA_DETECTION)
+    conn.close()
+    base_faces = sample_faces(dataset_path)
+    results['rosters'] = {}
+    for num_students in student_counts:
+        images, labels = synthetic_roster(base_faces, num_students, 4)
+        held_out = np.arange(3, len(images), 4)
+        keep = np.ones(len(images), dtype=bool)
+        keep[held_out] = False
+        recognizer = create_recognizer()
+        recognizer.train([img for img, kept in zip(images, keep) if kept], labels[keep])
+        model = LBPHModel.from_recognizer(recognizer)
+        queries = [images[i] for i in held_out[:faces_per_frame]]
+        del images, recognizer
+
+        row = {'histograms': len(model)}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            binary_path = os.path.join(tmp_dir, 'trainer.lbph')
+            yaml_path = os.path.join(tmp_dir, 'trainer.yml')
+            model.save(binary_path)
+            model.write_yaml(yaml_path)
+            row['load_binary_ms'] = _time_ms(lambda: HistogramMatcher.from_model(LBPHModel.load(binary_path)),
+                                             repeats)
+            row['load_yaml_ms'] = _time_ms(lambda: HistogramMatcher.from_model(LBPHModel.read_yaml(yaml_path)), 1)
+
+        face_recognizer.snapshot = ModelSnapshot(model, HistogramMatcher.from_model(model), {}, None)
+        row['predict_ms_per_face'] = _time_ms(lambda: face_recognizer.predict_faces(queries),
+                                              repeats) / len(queries)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            for frame in frames:
+                face_recognizer.recognize_face(frame.copy())
+        row['end_to_end_fps'] = repeats * len(frames) / (time.perf_counter() - start)
+        results['rosters'][num_students] = row
+        print(f"[BENCH] roster students={num_students} histograms={len(model)}: "
+              f"load {row['load_binary_ms']:.1f} ms (yaml {row['load_yaml_ms']:.0f} ms), "
+              f"predict {row['predict_ms_per_face']:.2f} ms/face, end-to-end {row['end_to_end_fps']:.1f} FPS")
+
+    results['peak_rss_mb'] = peak_rss_mb()
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'opencv': cv2.__version__,
+        'dataset': dataset_path,
+        'results': results,
+        'timing': Timing.report(),
+    }
+    Timing.enable(False)
+    if output:
+        with open(output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+        peak = results['peak_rss_mb']
+        print(f"[BENCH] peak RSS {'n/a' if peak is None else f'{peak:.0f} MB'}, results written to {output}")
+    return report
+
+
+def _flatten(data, prefix=''):
+    values = {}
+    for key, value in data.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            values.update(_flatten(value, name + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[name] = value
+    return values
+
+
+# so sánh hai file kết quả của run_suite, in thay đổi (%) của từng chỉ số
+def compare_results(baseline_path, current_path):
+    with open(baseline_path, 'r', encoding='utf-8') as file:
+        baseline = _flatten(json.load(file)['results'])
+    with open(current_path, 'r', encoding='utf-8') as file:
+        current = _flatten(json.load(file)['results'])
+    changes = {}
+    for name in sorted(baseline.keys() & current.keys()):
+        if baseline[name]:
+            changes[name] = (current[name] - baseline[name]) / baseline[name]
+            print(f"[BENCH] {name}: {baseline[name]:.2f} -> {current[name]:.2f} ({changes[name]:+.1%})")
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark các bước xử lý của LBPH")
+    parser.add_argument('benchmark', choices=['preprocess', 'match', 'ann', 'import', 'suite'])
+    parser.add_argument('--dataset', default=DATASET_PATH)
+    parser.add_argument('--workers', type=int, nargs='+', help="số tiến trình, mặc định 1 2 4 N")
+    parser.add_argument('--students', type=int, nargs='+', help="số sinh viên giả lập, mặc định 100 1000 10000 "
+                                                                 "(suite: 100 1000)")
+    parser.add_argument('--output', default=RESULTS_PATH, help="file kết quả JSON của suite")
+    parser.add_argument('--compare', help="file kết quả cũ để so sánh với kết quả suite mới")
+    args = parser.parse_args()
+
+    if args.benchmark == 'preprocess':
+        benchmark_preprocessing(args.dataset, args.workers)
+    elif args.benchmark == 'match':
+        benchmark_matcher(args.students or [100, 1000, 10000], dataset_path=args.dataset)
+    elif args.benchmark == 'ann':
+        benchmark_ann(args.dataset, max(args.students or [10000]))
+    elif args.benchmark == 'import':
+        benchmark_import(args.dataset, args.workers)
+    elif args.benchmark == 'suite':
+        run_suite(args.dataset, args.students or [100, 1000], args.output)
+        if args.compare:
+            compare_results(args.compare, args.output)
+
+
+if __name__ == '__main__':
+    main()
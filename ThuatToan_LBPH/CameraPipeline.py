@@ -0,0 +1,129 @@
+import queue
+import threading
+import time
+import traceback
+
+import cv2
+from PIL import Image
+
+from .Timing import StageStats
+
+
+# Pipeline camera nhiều luồng: luồng đọc camera -> luồng nhận diện -> luồng chuyển ảnh sang PIL, nối bằng các
+# hàng đợi có giới hạn. Khi hàng đợi đầy, khung hình cũ bị bỏ để luôn xử lý khung mới nhất.
+# Luồng Tk chỉ cần gọi latest() và hiển thị ảnh.
+class CameraPipeline:
+    # process(frame) -> (annotated_frame, recognized_faces), ví dụ FaceRecognizer.recognize_face
+    # max_errors: số khung hình lỗi liên tiếp khi nhận diện trước khi dừng pipeline (failed = True)
+    def __init__(self, capture, process, queue_size=1, display_size=None, flip=True, max_errors=5):
+        self.capture = capture
+        self.process = process
+        self.display_size = display_size
+        self.flip = flip
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.annotated = queue.Queue(maxsize=queue_size)
+        self.rendered = queue.Queue(maxsize=1)
+        self.stats = {name: StageStats() for name in ('capture', 'recognize', 'render', 'end_to_end')}
+        self.running = False
+        self.failed = False
+        self.error = None
+        self.max_errors = max_errors
+        self.started_at = None
+        self._threads = []
+
+    def start(self):
+        self.running = True
+        self.failed = False
+        self.error = None
+        self.started_at = time.perf_counter()
+        self._threads = [threading.Thread(target=target, daemon=True)
+                         for target in (self._capture_loop, self._recognize_loop, self._render_loop)]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self.running = False
+        for thread in self._threads:
+            thread.join(timeout=1.0)
+        self._threads = []
+
+    # ảnh PIL và danh sách khuôn mặt của khung hình mới nhất, hoặc None nếu chưa có khung mới
+    def latest(self):
+        try:
+            img, recognized_faces, captured_at = self.rendered.get_nowait()
+        except queue.Empty:
+            return None
+        # độ trễ từ lúc đọc camera đến lúc khung hình được đưa cho giao diện
+        self.stats['end_to_end'].add((time.perf_counter() - captured_at) * 1000)
+        return img, recognized_faces
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started_at if self.started_at else 0.0
+        report = {name: stats.as_dict() for name, stats in self.stats.items()}
+        report['queue_depth'] = {'frames': self.frames.qsize(), 'annotated': self.annotated.qsize(),
+                                 'rendered': self.rendered.qsize()}
+        report['fps'] = self.stats['end_to_end'].count / elapsed if elapsed > 0 else 0.0
+        return report
+
+    def _capture_loop(self):
+        while self.running:
+            start = time.perf_counter()
+            ret, frame = self.capture.read()
+            if not ret:
+                self.failed = True
+                self.running = False
+                break
+            if self.flip:
+                frame = cv2.flip(frame, 1)  # Lật hình ảnh ngang
+            self.stats['capture'].add((time.perf_counter() - start) * 1000)
+            self._put_latest(self.frames, (frame, start), 'capture')
+
+    def _recognize_loop(self):
+        errors = 0
+        while self.running:
+            try:
+                frame, captured_at = self.frames.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            start = time.perf_counter()
+            try:
+                annotated, recognized_faces = self.process(frame)
+            except Exception as e:
+                # bỏ khung hình lỗi; lỗi lặp lại liên tục thì dừng để giao diện không đứng ở khung hình cũ
+                traceback.print_exc()
+                self.stats['recognize'].dropped += 1
+                errors += 1
+                if errors >= self.max_errors:
+                    self.error = e
+                    self.failed = True
+                    self.running = False
+                continue
+            errors = 0
+            self.stats['recognize'].add((time.perf_counter() - start) * 1000)
+            self._put_latest(self.annotated, (annotated, recognized_faces, captured_at), 'recognize')
+
+    def _render_loop(self):
+        while self.running:
+            try:
+                annotated, recognized_faces, captured_at = self.annotated.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            start = time.perf_counter()
+            img = Image.fromarray(cv2.cvtColor(annotated, cv2.COLOR_BGR2RGB))
+            if self.display_size is not None:
+                img = img.resize(self.display_size, Image.LANCZOS)
+            self.stats['render'].add((time.perf_counter() - start) * 1000)
+            self._put_latest(self.rendered, (img, recognized_faces, captured_at), 'render')
+
+    # thêm vào hàng đợi; nếu đầy thì bỏ phần tử cũ nhất (đã lỗi thời)
+    def _put_latest(self, target, item, stage):
+        while True:
+            try:
+                target.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    target.get_nowait()
+                    self.stats[stage].dropped += 1
+                except queue.Empty:
+                    pass
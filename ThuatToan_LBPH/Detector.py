@@ -0,0 +1,66 @@
+import os
+
+import cv2
+import numpy as np
+
+CASCADE_PATH = os.path.join(os.path.dirname(__file__), 'haarcascade_frontalface_default.xml')
+
+
+# Toàn bộ tham số phát hiện khuôn mặt, dùng chung cho lúc train (Train.py) và lúc nhận diện (Recognize.py)
+class DetectionConfig:
+    def __init__(self, scale_factor=1.2, min_neighbors=7, min_size=(30, 30), downscale=1.0, max_side=None,
+                 roi=None):
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        # kích thước khuôn mặt nhỏ nhất, tính theo ảnh gốc
+        self.min_size = tuple(min_size)
+        # phát hiện trên ảnh thu nhỏ downscale lần; max_side giới hạn thêm cạnh dài nhất của ảnh được phát hiện
+        self.downscale = downscale
+        self.max_side = max_side
+        # vùng quan tâm (x, y, w, h) theo ảnh gốc; None = cả ảnh
+        self.roi = tuple(roi) if roi is not None else None
+
+    # chuỗi mô tả tham số, dùng làm khóa của cache khuôn mặt
+    def signature(self):
+        return (f"sf={self.scale_factor};mn={self.min_neighbors};ms={self.min_size[0]}x{self.min_size[1]};"
+                f"ds={self.downscale};max={self.max_side};roi={self.roi}")
+
+
+class FaceDetector:
+    def __init__(self, config=None, cascade_path=CASCADE_PATH):
+        self.config = config or DetectionConfig()
+        self.cascade = cv2.CascadeClassifier(cascade_path)
+
+    # trả về mảng (N, 4) các khung (x, y, w, h) theo tọa độ ảnh gốc
+    def detect(self, gray):
+        config = self.config
+        offset_x = offset_y = 0
+        if config.roi is not None:
+            x, y, w, h = config.roi
+            offset_x, offset_y = max(0, x), max(0, y)
+            gray = gray[offset_y:y + h, offset_x:x + w]
+        if gray.size == 0:
+            return np.empty((0, 4), dtype=np.int32)
+
+        scale = max(1.0, config.downscale)
+        if config.max_side:
+            scale = max(scale, max(gray.shape) / config.max_side)
+        if scale > 1.0:
+            small = cv2.resize(gray, (max(1, round(gray.shape[1] / scale)), max(1, round(gray.shape[0] / scale))),
+                               interpolation=cv2.INTER_AREA)
+        else:
+            small = gray
+        min_size = (max(1, int(config.min_size[0] / scale)), max(1, int(config.min_size[1] / scale)))
+        faces = self.cascade.detectMultiScale(small, scaleFactor=config.scale_factor,
+                                              minNeighbors=config.min_neighbors, minSize=min_size)
+        if len(faces) == 0:
+            return np.empty((0, 4), dtype=np.int32)
+
+        # đưa khung về tọa độ ảnh gốc
+        faces = np.round(np.asarray(faces, dtype=np.float64) * scale).astype(np.int32)
+        faces[:, 0] += offset_x
+        faces[:, 1] += offset_y
+        # không để khung vượt ra ngoài ảnh sau khi làm tròn
+        faces[:, 2] = np.minimum(faces[:, 2], offset_x + gray.shape[1] - faces[:, 0])
+        faces[:, 3] = np.minimum(faces[:, 3], offset_y + gray.shape[0] - faces[:, 1])
+        return faces
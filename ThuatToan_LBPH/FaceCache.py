@@ -0,0 +1,58 @@
+import sqlite3
+
+import numpy as np
+
+
+# Cache vùng khuôn mặt đã cắt (ảnh xám) theo hash nội dung của ảnh gốc,
+# để những lần train sau không phải chạy lại Haar cascade trên ảnh không đổi.
+class FaceCache:
+    def __init__(self, path, detector_params=''):
+        self.conn = sqlite3.connect(path)
+        # kết quả phát hiện phụ thuộc tham số của detector, nên tham số là một phần của khóa
+        self.detector_params = detector_params
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS scanned_images
+                             (image_key TEXT,
+                              detector_params TEXT,
+                              num_faces INTEGER,
+                              PRIMARY KEY(image_key, detector_params))''')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS face_crops
+                             (image_key TEXT,
+                              detector_params TEXT,
+                              face_index INTEGER,
+                              x INTEGER, y INTEGER, w INTEGER, h INTEGER,
+                              crop BLOB,
+                              PRIMARY KEY(image_key, detector_params, face_index))''')
+        self.conn.commit()
+
+    def get(self, image_key):
+        row = self.conn.execute("SELECT num_faces FROM scanned_images WHERE image_key=? AND detector_params=?",
+                                (image_key, self.detector_params)).fetchone()
+        if row is None:
+            return None
+        rows = self.conn.execute('''SELECT w, h, crop FROM face_crops
+                                    WHERE image_key=? AND detector_params=? ORDER BY face_index''',
+                                 (image_key, self.detector_params)).fetchall()
+        return [np.frombuffer(crop, dtype=np.uint8).reshape(h, w) for w, h, crop in rows]
+
+    def get_boxes(self, image_key):
+        rows = self.conn.execute('''SELECT x, y, w, h FROM face_crops
+                                    WHERE image_key=? AND detector_params=? ORDER BY face_index''',
+                                 (image_key, self.detector_params)).fetchall()
+        return [tuple(row) for row in rows]
+
+    def put(self, image_key, faces, boxes):
+        self.conn.execute("INSERT OR REPLACE INTO scanned_images VALUES (?, ?, ?)",
+                          (image_key, self.detector_params, len(faces)))
+        self.conn.execute("DELETE FROM face_crops WHERE image_key=? AND detector_params=?",
+                          (image_key, self.detector_params))
+        self.conn.executemany("INSERT INTO face_crops VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                              [(image_key, self.detector_params, i, int(x), int(y), int(w), int(h),
+                                np.ascontiguousarray(face).tobytes())
+                               for i, (face, (x, y, w, h)) in enumerate(zip(faces, boxes))])
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
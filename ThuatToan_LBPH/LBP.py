@@ -0,0 +1,55 @@
+import numpy as np
+
+
+# Tính đặc trưng LBPH bằng NumPy, cho kết quả giống cv2.face.LBPHFaceRecognizer
+# (elbp + spatial_histogram trong opencv_contrib), để có thể so khớp mà không cần nạp lại mô hình OpenCV.
+
+def elbp(src, radius, neighbors):
+    src = np.asarray(src, dtype=np.float32)
+    rows, cols = src.shape
+    center = src[radius:rows - radius, radius:cols - radius]
+    dst = np.zeros(center.shape, dtype=np.int32)
+    eps = np.finfo(np.float32).eps
+    for n in range(neighbors):
+        # điểm lấy mẫu trên đường tròn, tính bằng double rồi ép về float như OpenCV
+        x = np.float32(radius * np.cos(2.0 * np.pi * n / float(neighbors)))
+        y = np.float32(-radius * np.sin(2.0 * np.pi * n / float(neighbors)))
+        fx, fy = int(np.floor(x)), int(np.floor(y))
+        cx, cy = int(np.ceil(x)), int(np.ceil(y))
+        ty = np.float32(y - fy)
+        tx = np.float32(x - fx)
+        # trọng số nội suy song tuyến
+        w1 = np.float32((1 - tx) * (1 - ty))
+        w2 = np.float32(tx * (1 - ty))
+        w3 = np.float32((1 - tx) * ty)
+        w4 = np.float32(tx * ty)
+        t = (w1 * _shifted(src, radius, fy, fx) + w2 * _shifted(src, radius, fy, cx) +
+             w3 * _shifted(src, radius, cy, fx) + w4 * _shifted(src, radius, cy, cx))
+        dst += ((t > center) | (np.abs(t - center) < eps)).astype(np.int32) << n
+    return dst
+
+
+def _shifted(src, radius, dy, dx):
+    rows, cols = src.shape
+    return src[radius + dy:rows - radius + dy, radius + dx:cols - radius + dx]
+
+
+def spatial_histogram(lbp_image, num_patterns, grid_x, grid_y):
+    width = lbp_image.shape[1] // grid_x
+    height = lbp_image.shape[0] // grid_y
+    num_cells = grid_x * grid_y
+    if width == 0 or height == 0:
+        return np.zeros((1, num_cells * num_patterns), dtype=np.float32)
+    cells = (lbp_image[:grid_y * height, :grid_x * width]
+             .reshape(grid_y, height, grid_x, width)
+             .transpose(0, 2, 1, 3)
+             .reshape(num_cells, height * width))
+    # mỗi ô lưới dùng một đoạn bin riêng để đếm tất cả các ô bằng một lần bincount
+    offsets = (np.arange(num_cells) * num_patterns)[:, None]
+    hist = np.bincount((cells + offsets).ravel(), minlength=num_cells * num_patterns).astype(np.float32)
+    hist /= np.float32(height * width)
+    return hist.reshape(1, -1)
+
+
+def lbp_histogram(face, radius, neighbors, grid_x, grid_y):
+    return spatial_histogram(elbp(face, radius, neighbors), 2 ** neighbors, grid_x, grid_y)
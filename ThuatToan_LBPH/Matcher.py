@@ -0,0 +1,139 @@
+import numpy as np
+
+# giống DBL_EPSILON trong cv2.compareHist
+_EPS = np.finfo(np.float64).eps
+_NO_MATCH = np.finfo(np.float64).max
+
+
+# So khớp hàng loạt: mọi khuôn mặt trong một khung hình được so với toàn bộ histogram trong một lần gọi.
+# Khoảng cách là chi-square (HISTCMP_CHI_SQR_ALT) như LBPHFaceRecognizer.predict và kết quả giống hệt predict.
+#
+# Với a, b >= 0 ta có 2 * (sqrt(a) - sqrt(b))^2 <= 2 * (a - b)^2 / (a + b), nên khoảng cách Hellinger
+# (tính cho mọi cặp bằng một phép nhân ma trận) là cận dưới của chi-square. Chỉ những histogram có cận dưới
+# nhỏ hơn khoảng cách tốt nhất đã biết mới cần tính chi-square đầy đủ.
+#
+# Nếu có chỉ mục IVF (AnnIndex.py), chỉ các histogram trong những cụm gần query nhất được xét (gần đúng).
+class HistogramMatcher:
+    def __init__(self, histograms, labels, threshold=_NO_MATCH, prototypes=False, candidates=16, index=None):
+        histograms = np.ascontiguousarray(histograms, dtype=np.float32)
+        labels = np.ascontiguousarray(labels, dtype=np.int32).ravel()
+        if prototypes and len(labels):
+            histograms, labels = class_prototypes(histograms, labels)
+            # chỉ mục được xây trên các hàng gốc, nên không dùng được cùng prototypes
+            index = None
+        # số thứ tự hàng trong mô hình gốc, để phân xử khi khoảng cách bằng nhau giống như predict
+        rows = np.arange(len(labels), dtype=np.int32)
+        if index is not None:
+            # sắp xếp lại theo cụm để mỗi cụm IVF là một đoạn liên tục trong bộ nhớ
+            rows = index.list_rows
+            histograms = histograms[rows]
+            labels = labels[rows]
+        self.histograms = histograms
+        self.labels = labels
+        self.threshold = threshold
+        # số histogram được tính chi-square trước tiên để có ngưỡng cắt tỉa
+        self.candidates = candidates
+        self.index = index
+        self._rows = rows
+        self._sqrt = np.sqrt(histograms)
+        self._sums = histograms.sum(axis=1, dtype=np.float64).astype(np.float32)
+
+    @classmethod
+    def from_model(cls, model, prototypes=False, index=None):
+        return cls(model.histograms, model.labels, model.threshold, prototypes, index=index)
+
+    def __len__(self):
+        return len(self.labels)
+
+    # cận dưới của khoảng cách chi-square từ mỗi query (Q x D) tới mỗi histogram, kết quả Q x N
+    def lower_bounds(self, queries):
+        cross = np.sqrt(queries) @ self._sqrt.T
+        return 2 * (self._sums[None, :] + queries.sum(axis=1)[:, None] - 2 * cross)
+
+    # trả về (labels, distances) của histogram gần nhất cho từng query; -1 nếu vượt ngưỡng
+    def match(self, queries):
+        num_queries = len(queries)
+        labels = np.full(num_queries, -1, np.int32)
+        distances = np.full(num_queries, _NO_MATCH)
+        if len(self) == 0 or num_queries == 0:
+            return labels, distances
+
+        queries = np.ascontiguousarray(queries, dtype=np.float32).reshape(num_queries, -1)
+        if self.index is not None:
+            for i, query in enumerate(queries):
+                self._match_ivf(labels, distances, i, query)
+            return labels, distances
+
+        bounds = self.lower_bounds(queries)
+        for i, query in enumerate(queries):
+            rows, dist, _ = self._search(query, bounds[i], 0, np.inf)
+            self._set_best(labels, distances, i, rows, dist)
+        return labels, distances
+
+    # chỉ xét các cụm gần nhất, lần lượt từ gần đến xa; cận dưới vẫn dùng để bỏ qua hàng trong từng cụm
+    def _match_ivf(self, labels, distances, i, query):
+        sqrt_query = np.sqrt(query)
+        query_sum = query.sum()
+        found_rows = []
+        found_dist = []
+        limit = np.inf
+        for start, stop in self.index.probe(sqrt_query):
+            bound = 2 * (self._sums[start:stop] + query_sum - 2 * (self._sqrt[start:stop] @ sqrt_query))
+            rows, dist, limit = self._search(query, bound, start, limit)
+            found_rows.append(rows)
+            found_dist.append(dist)
+        self._set_best(labels, distances, i, np.concatenate(found_rows), np.concatenate(found_dist))
+
+    # tính chi-square cho các hàng (offset + j) có cận dưới bound[j] nhỏ hơn limit;
+    # nếu chưa có limit thì tính trước một số ứng viên có cận dưới nhỏ nhất để có ngưỡng cắt tỉa
+    def _search(self, query, bound, offset, limit):
+        rows = np.empty(0, dtype=np.int64)
+        dist = np.empty(0)
+        if limit == np.inf and len(bound) > self.candidates:
+            rows = np.argpartition(bound, self.candidates - 1)[:self.candidates]
+            dist = chi_square(query, self.histograms[offset + rows])
+            limit = _prune_limit(dist.min())
+            bound = bound.copy()
+            bound[rows] = np.inf
+        rest = np.flatnonzero(bound < limit)
+        if len(rest):
+            rest_dist = chi_square(query, self.histograms[offset + rest])
+            rows = np.concatenate([rows, rest])
+            dist = np.concatenate([dist, rest_dist])
+            limit = min(limit, _prune_limit(rest_dist.min()))
+        return offset + rows, dist, limit
+
+    def _set_best(self, labels, distances, i, rows, dist):
+        # không có ứng viên nào (ví dụ mọi cụm được thăm đều rỗng): giữ kết quả -1
+        if len(rows) == 0:
+            return
+        # khi khoảng cách bằng nhau, chọn histogram đứng trước giống như predict
+        best = np.lexsort((self._rows[rows], dist))[0]
+        if dist[best] < self.threshold:
+            labels[i] = self.labels[rows[best]]
+            distances[i] = dist[best]
+
+
+# nới ngưỡng một chút để sai số float32 của phép nhân ma trận không loại nhầm ứng viên
+def _prune_limit(best):
+    return best * (1 + 1e-3) + 1e-6
+
+
+# chi-square (HISTCMP_CHI_SQR_ALT) giữa một histogram và từng hàng của ma trận
+def chi_square(query, histograms):
+    diff = histograms - query
+    total = histograms + query
+    np.multiply(diff, diff, out=diff)
+    # histogram không âm nên total <= EPS kéo theo diff^2 <= EPS^2: chặn dưới mẫu số thay cho phép chia có điều kiện
+    np.maximum(total, _EPS, out=total)
+    np.divide(diff, total, out=diff)
+    return 2 * diff.sum(axis=1, dtype=np.float64)
+
+
+# gộp các histogram của cùng một sinh viên thành một histogram trung bình để giảm số phép so sánh
+def class_prototypes(histograms, labels):
+    classes, inverse = np.unique(labels, return_inverse=True)
+    sums = np.zeros((len(classes), histograms.shape[1]), dtype=np.float64)
+    np.add.at(sums, inverse, histograms)
+    counts = np.bincount(inverse, minlength=len(classes))[:, None]
+    return (sums / counts).astype(np.float32), classes.astype(np.int32)
@@ -0,0 +1,197 @@
+import argparse
+import json
+import os
+import struct
+import tempfile
+
+import cv2
+import numpy as np
+
+from .Augment import FaceNormalization
+from .LBP import lbp_histogram
+
+
+# Định dạng nhị phân của mô hình LBPH: MAGIC, độ dài header (uint32), header JSON,
+# rồi ma trận histogram float32 (N x D) và nhãn int32 (N) được căn lề để đọc bằng memory map.
+MAGIC = b'LBPHBIN1'
+ALIGNMENT = 64
+
+
+class LBPHModel:
+    def __init__(self, histograms, labels, radius=1, neighbors=8, grid_x=8, grid_y=8,
+                 threshold=np.finfo(np.float64).max, label_info=None, normalization=None):
+        self.histograms = histograms
+        self.labels = labels
+        self.radius = radius
+        self.neighbors = neighbors
+        self.grid_x = grid_x
+        self.grid_y = grid_y
+        self.threshold = threshold
+        self.label_info = label_info or {}
+        # FaceNormalization đã dùng cho ảnh train (None: khuôn mặt thô), áp dụng lại trong histogram()
+        self.normalization = normalization
+
+    def __len__(self):
+        return len(self.labels)
+
+    @classmethod
+    def from_recognizer(cls, recognizer, normalization=None):
+        histograms = recognizer.getHistograms()
+        histograms = np.vstack(histograms).astype(np.float32) if len(histograms) else np.zeros((0, 0), np.float32)
+        labels = np.asarray(recognizer.getLabels(), dtype=np.int32).ravel()
+        label_info = {}
+        for label in np.unique(labels):
+            info = recognizer.getLabelInfo(int(label))
+            if info:
+                label_info[int(label)] = info
+        return cls(histograms, labels, recognizer.getRadius(), recognizer.getNeighbors(),
+                   recognizer.getGridX(), recognizer.getGridY(), recognizer.getThreshold(), label_info,
+                   normalization)
+
+    def to_recognizer(self):
+        recognizer = cv2.face.LBPHFaceRecognizer_create()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'model.yml')
+            self.write_yaml(path)
+            recognizer.read(path)
+        return recognizer
+
+    @classmethod
+    def read_yaml(cls, path):
+        fs = cv2.FileStorage(path, cv2.FILE_STORAGE_READ)
+        try:
+            node = fs.getNode('opencv_lbphfaces')
+            hist_node = node.getNode('histograms')
+            histograms = [hist_node.at(i).mat() for i in range(hist_node.size())]
+            histograms = np.vstack(histograms).astype(np.float32) if histograms else np.zeros((0, 0), np.float32)
+            labels_mat = node.getNode('labels').mat()
+            labels = np.asarray(labels_mat, dtype=np.int32).ravel() if labels_mat is not None \
+                else np.zeros(0, np.int32)
+            label_info = {}
+            info_node = node.getNode('labelsInfo')
+            for i in range(info_node.size()):
+                item = info_node.at(i)
+                label_info[int(item.getNode('label').real())] = item.getNode('value').string()
+            # nút chuẩn hóa nằm sau opencv_lbphfaces nên LBPHFaceRecognizer.read bỏ qua nó
+            normalization = None
+            norm_node = fs.getNode('normalization')
+            if not norm_node.empty():
+                normalization = FaceNormalization((int(norm_node.getNode('width').real()),
+                                                   int(norm_node.getNode('height').real())),
+                                                  bool(norm_node.getNode('equalize').real()))
+            return cls(histograms, labels,
+                       int(node.getNode('radius').real()), int(node.getNode('neighbors').real()),
+                       int(node.getNode('grid_x').real()), int(node.getNode('grid_y').real()),
+                       node.getNode('threshold').real(), label_info, normalization)
+        finally:
+            fs.release()
+
+    def write_yaml(self, path):
+        fs = cv2.FileStorage(path, cv2.FILE_STORAGE_WRITE)
+        try:
+            fs.startWriteStruct('opencv_lbphfaces', cv2.FileNode_MAP)
+            fs.write('threshold', float(self.threshold))
+            fs.write('radius', int(self.radius))
+            fs.write('neighbors', int(self.neighbors))
+            fs.write('grid_x', int(self.grid_x))
+            fs.write('grid_y', int(self.grid_y))
+            fs.startWriteStruct('histograms', cv2.FileNode_SEQ)
+            for hist in self.histograms:
+                fs.write('', np.asarray(hist, dtype=np.float32).reshape(1, -1))
+            fs.endWriteStruct()
+            fs.write('labels', np.asarray(self.labels, dtype=np.int32).reshape(-1, 1))
+            fs.startWriteStruct('labelsInfo', cv2.FileNode_SEQ)
+            for label, value in sorted(self.label_info.items()):
+                fs.startWriteStruct('', cv2.FileNode_MAP)
+                fs.write('label', int(label))
+                fs.write('value', str(value))
+                fs.endWriteStruct()
+            fs.endWriteStruct()
+            fs.endWriteStruct()
+            if self.normalization is not None:
+                fs.startWriteStruct('normalization', cv2.FileNode_MAP)
+                fs.write('width', self.normalization.size[0])
+                fs.write('height', self.normalization.size[1])
+                fs.write('equalize', int(self.normalization.equalize))
+                fs.endWriteStruct()
+        finally:
+            fs.release()
+
+    # Ghi ra định dạng nhị phân
+    def save(self, path):
+        histograms = np.ascontiguousarray(self.histograms, dtype=np.float32)
+        labels = np.ascontiguousarray(self.labels, dtype=np.int32)
+        header = {
+            'radius': int(self.radius),
+            'neighbors': int(self.neighbors),
+            'grid_x': int(self.grid_x),
+            'grid_y': int(self.grid_y),
+            'threshold': float(self.threshold),
+            'shape': list(histograms.shape),
+            'label_info': {str(label): value for label, value in self.label_info.items()},
+            'normalization': self.normalization.to_dict() if self.normalization is not None else None,
+        }
+        header_bytes = json.dumps(header).encode('utf-8')
+        data_offset = _align(len(MAGIC) + 4 + len(header_bytes))
+        labels_offset = _align(data_offset + histograms.nbytes)
+        with open(path, 'wb') as file:
+            file.write(MAGIC)
+            file.write(struct.pack('<I', len(header_bytes)))
+            file.write(header_bytes)
+            file.write(b'\0' * (data_offset - file.tell()))
+            file.write(histograms.tobytes())
+            file.write(b'\0' * (labels_offset - file.tell()))
+            file.write(labels.tobytes())
+
+    # Đọc định dạng nhị phân; mmap=True chỉ ánh xạ file vào bộ nhớ, dữ liệu được đọc khi cần
+    @classmethod
+    def load(cls, path, mmap=True):
+        with open(path, 'rb') as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a binary LBPH model")
+            header_len = struct.unpack('<I', file.read(4))[0]
+            header = json.loads(file.read(header_len).decode('utf-8'))
+        rows, cols = header['shape']
+        data_offset = _align(len(MAGIC) + 4 + header_len)
+        labels_offset = _align(data_offset + rows * cols * 4)
+        if mmap and rows > 0:
+            histograms = np.memmap(path, dtype=np.float32, mode='r', offset=data_offset, shape=(rows, cols))
+            labels = np.memmap(path, dtype=np.int32, mode='r', offset=labels_offset, shape=(rows,))
+        else:
+            with open(path, 'rb') as file:
+                file.seek(data_offset)
+                histograms = np.fromfile(file, dtype=np.float32, count=rows * cols).reshape(rows, cols)
+                file.seek(labels_offset)
+                labels = np.fromfile(file, dtype=np.int32, count=rows)
+        label_info = {int(label): value for label, value in header['label_info'].items()}
+        return cls(histograms, labels, header['radius'], header['neighbors'],
+                   header['grid_x'], header['grid_y'], header['threshold'], label_info,
+                   FaceNormalization.from_dict(header.get('normalization')))
+
+    def histogram(self, face):
+        if self.normalization is not None:
+            face = self.normalization.apply(face)
+        return lbp_histogram(face, self.radius, self.neighbors, self.grid_x, self.grid_y)
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+# chuyển đổi giữa trainer.yml và định dạng nhị phân
+def main():
+    parser = argparse.ArgumentParser(description="Chuyển đổi mô hình LBPH giữa YAML và định dạng nhị phân")
+    parser.add_argument('direction', choices=['to-binary', 'to-yaml'])
+    parser.add_argument('source')
+    parser.add_argument('target')
+    args = parser.parse_args()
+
+    if args.direction == 'to-binary':
+        LBPHModel.read_yaml(args.source).save(args.target)
+    else:
+        LBPHModel.load(args.source, mmap=False).write_yaml(args.target)
+    print(f"[INFO] Converted {args.source} -> {args.target}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,62 +1,246 @@
 import cv2
+import numpy as np
+import json
 import os
+import threading
+
+from .AnnIndex import IVFIndex, model_fingerprint
+from .Detector import FaceDetector
+from .Matcher import HistogramMatcher
+from .ModelStore import LBPHModel
+from .Timing import timed
+
+TRAINER_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'trainer')
+
+
+# (tên, mtime, kích thước) của các file mô hình; thay đổi khi train xong hoặc file bị thay trên đĩa
+def model_version(trainer_dir=TRAINER_DIR):
+    version = []
+    for name in ('trainer.yml', 'trainer.lbph', 'trainer_index.npz'):
+        try:
+            stat = os.stat(os.path.join(trainer_dir, name))
+        except FileNotFoundError:
+            continue
+        version.append((name, stat.st_mtime_ns, stat.st_size))
+    return tuple(version)
+
+
+# Mô hình, bộ so khớp và bảng nhãn của một lần nạp. Khi mô hình trên đĩa thay đổi, cả khối được thay bằng một
+# phép gán duy nhất: khung hình đang xử lý vẫn dùng bản cũ, khung hình sau dùng bản mới.
+class ModelSnapshot:
+    def __init__(self, model=None, matcher=None, label_msv_map=None, version=None):
+        self.model = model
+        self.matcher = matcher
+        self.label_msv_map = label_msv_map or {}
+        self.version = version
 
 
 class FaceRecognizer:
-    def __init__(self, db_cursor):
-        self.recognizer = cv2.face.LBPHFaceRecognizer_create()
-        trainer_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'trainer', 'trainer.yml')
-        if os.path.exists(trainer_path):
-            self.recognizer.read(trainer_path)
+    # nprobe: số cụm IVF được xét cho mỗi khuôn mặt (lớn hơn = chính xác hơn, chậm hơn)
+    def __init__(self, db_cursor, use_prototypes=False, nprobe=4, detection=None):
+        self.use_prototypes = use_prototypes
+        self.nprobe = nprobe
+        self.trainer_dir = TRAINER_DIR
+
+        # detection: DetectionConfig (thu nhỏ ảnh, vùng quan tâm, tham số cascade); mặc định như trước
+        self.detector = FaceDetector(detection)
+
+        self.font = cv2.FONT_HERSHEY_SIMPLEX
+
+        # Tên lấy theo msv từ cơ sở dữ liệu; đổi tên sinh viên chỉ cần refresh_names(), không phải nạp lại mô hình
+        self.refresh_names(db_cursor)
+
+        # on_identified(msv, confidence_value) được gọi cho mỗi khuôn mặt nhận ra được, ví dụ để điểm danh
+        self.on_identified = None
+
+        self.reload_lock = threading.Lock()
+        self.watcher = None
+        self.stop_watch = threading.Event()
+        self.snapshot = self._load_snapshot(self.model_version())
+
+    @property
+    def model(self):
+        return self.snapshot.model
+
+    @property
+    def matcher(self):
+        return self.snapshot.matcher
+
+    @property
+    def label_msv_map(self):
+        return self.snapshot.label_msv_map
+
+    def _path(self, name):
+        return os.path.join(self.trainer_dir, name)
+
+    def model_version(self):
+        return model_version(self.trainer_dir)
+
+    def _load_snapshot(self, version):
+        model = None
+        matcher = None
+        trainer_path = self._path('trainer.yml')
+        binary_path = self._path('trainer.lbph')
+        # Ưu tiên bản nhị phân (đọc nhanh) nếu nó không cũ hơn trainer.yml. Không dùng memory map: trên Windows
+        # file đang được map không thể bị thay thế, khi đó train lại sẽ không ghi được trainer.lbph
+        if os.path.exists(binary_path) and (not os.path.exists(trainer_path) or
+                                            os.path.getmtime(binary_path) >= os.path.getmtime(trainer_path)):
+            with timed('model_load'):
+                model = LBPHModel.load(binary_path, mmap=False)
+        elif os.path.exists(trainer_path):
+            with timed('model_load'):
+                model = LBPHModel.read_yaml(trainer_path)
         else:
             print("Warning: trainer.yml not found. Face recognition may not work properly.")
+        if model is None:
+            return ModelSnapshot(version=version)
+
+        # chỉ mục IVF (nếu có) chỉ được dùng khi nó được xây từ đúng mô hình đang nạp
+        index = None
+        index_path = self._path('trainer_index.npz')
+        if os.path.exists(index_path):
+            index = IVFIndex.load(index_path, self.nprobe)
+            if index.fingerprint != model_fingerprint(model.histograms):
+                print("Warning: trainer_index.npz does not match the model, using exact search.")
+                index = None
+        # use_prototypes=True gộp histogram theo sinh viên: nhanh hơn nhưng kém chính xác hơn một chút
+        matcher = HistogramMatcher.from_model(model, prototypes=self.use_prototypes, index=index)
+
+        # Bảng nhãn -> msv được lưu cùng mô hình nên luôn khớp với nhãn lúc train
+        label_msv_map = dict(model.label_info)
+        state_path = self._path('trainer_state.json')
+        if not label_msv_map and os.path.exists(state_path):
+            # mô hình cũ: bảng nhãn nằm trong trainer_state.json
+            with open(state_path, 'r', encoding='utf-8') as file:
+                labels = json.load(file).get('labels', {})
+            label_msv_map = {label: msv for msv, label in labels.items()}
+        if not label_msv_map:
+            # mô hình rất cũ không có bảng nhãn: giữ cách gán cũ theo thứ tự trong bảng students
+            print("Warning: the model has no label table, retrain it to get reliable names.")
+            label_msv_map = dict(enumerate(self.msv_name_map))
+        return ModelSnapshot(model, matcher, label_msv_map, version)
+
+    # nạp lại mô hình nếu file trên đĩa đã thay đổi (hoặc force=True); trả về True nếu đã thay mô hình
+    def reload(self, force=False):
+        with self.reload_lock:
+            version = self.model_version()
+            if not force and version == self.snapshot.version:
+                return False
+            try:
+                snapshot = self._load_snapshot(version)
+            except (OSError, ValueError, cv2.error) as e:
+                # giữ mô hình đang dùng nếu bản mới không đọc được
+                print(f"Warning: could not reload the model: {e}")
+                return False
+            self.snapshot = snapshot
+            return True
+
+    # theo dõi file mô hình ở luồng nền; chỉ nạp lại khi các file đã ngừng thay đổi trong một chu kỳ
+    def start_watching(self, interval=2.0):
+        if self.watcher is not None:
+            return
+        self.stop_watch.clear()
+        self.watcher = threading.Thread(target=self._watch, args=(interval,), daemon=True)
+        self.watcher.start()
+
+    def stop_watching(self):
+        if self.watcher is None:
+            return
+        self.stop_watch.set()
+        self.watcher.join()
+        self.watcher = None
+
+    def _watch(self, interval):
+        last = self.model_version()
+        while not self.stop_watch.wait(interval):
+            version = self.model_version()
+            if version == last and version != self.snapshot.version and self.reload():
+                print("[INFO] Model reloaded")
+            last = version
+
+    # nhận diện tất cả khuôn mặt bằng một lần so khớp; trả về danh sách (id, confidence) như recognizer.predict
+    # snapshot: bản mô hình dùng cho cả khung hình (mặc định là bản mới nhất)
+    def predict_faces(self, faces, snapshot=None):
+        snapshot = snapshot or self.snapshot
+        if snapshot.matcher is None or not faces:
+            return [(-1, float('inf'))] * len(faces)
+        with timed('predict', len(faces)):
+            queries = np.vstack([snapshot.model.histogram(face) for face in faces])
+            labels, distances = snapshot.matcher.match(queries)
+        return [(int(label), float(dist)) for label, dist in zip(labels, distances)]
+
+    def predict(self, face):
+        return self.predict_faces([face])[0]
+
+    def detect_faces(self, gray):
+        with timed('detect'):
+            return self.detector.detect(gray)
+
+    # trả về (id, confidence_value) cho mỗi khuôn mặt; id = -1 nếu khoảng cách vượt ngưỡng
+    def identify_faces(self, gray, faces, snapshot=None):
+        predictions = self.predict_faces([gray[y:y + h, x:x + w] for (x, y, w, h) in faces], snapshot)
+        identities = []
+        for id, confidence in predictions:
+            if confidence < 85:
+                identities.append((id, round(100 - confidence, 2)))
+            else:
+                identities.append((-1, 0))
+        return identities
 
-        cascade_path = os.path.join(os.path.dirname(__file__), 'haarcascade_frontalface_default.xml')
-        self.faceCascade = cv2.CascadeClassifier(cascade_path)
+    def refresh_names(self, db_cursor):
+        db_cursor.execute("SELECT msv, name FROM students")
+        self.msv_name_map = dict(db_cursor.fetchall())
 
-        self.font = cv2.FONT_HERSHEY_SIMPLEX
+    def name_of(self, id, snapshot=None):
+        return self.msv_name_map.get(self.msv_of(id, snapshot), "Unknown")
 
-        # Lấy danh sách tên từ cơ sở dữ liệua
-        db_cursor.execute("SELECT DISTINCT msv, name FROM students")
-        self.id_name_map = {i: row[1] for i, row in enumerate(db_cursor.fetchall())}
+    def msv_of(self, id, snapshot=None):
+        return (snapshot or self.snapshot).label_msv_map.get(id)
 
-    def recognize_face(self, img):
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        faces = self.faceCascade.detectMultiScale(gray, scaleFactor=1.2, minNeighbors=7, minSize=(30, 30))
+    def notify(self, id, confidence_value, snapshot=None):
+        if self.on_identified is not None and id != -1:
+            self.on_identified(self.msv_of(id, snapshot), confidence_value)
 
-        recognized_faces = []
+    # Hiển thị khung, tên và độ tin cậy lên ảnh
+    def draw_face(self, img, face, person_name, confidence_value):
+        x, y, w, h = face
+        cv2.rectangle(img, (x, y), (x + w, y + h), (0, 255, 0), 2)
 
-        for (x, y, w, h) in faces:
-            cv2.rectangle(img, (x, y), (x + w, y + h), (0, 255, 0), 2)
-            id, confidence = self.recognizer.predict(gray[y:y + h, x:x + w])
+        label = f"{person_name} ({confidence_value:.2f}%)"
 
-            if confidence < 85:
-                person_name = self.id_name_map.get(id, "Unknown")
-                confidence_value = round(100 - confidence, 2)
-            else:
-                person_name = "Unknown"
-                confidence_value = 0
+        # Calculate position for text
+        label_size, _ = cv2.getTextSize(label, self.font, 0.7, 2)
+        text_x = x + (w - label_size[0]) // 2  # Center text horizontally
+        text_y = y - 10 if y - 10 > 10 else y + h + 30
 
-            # Hiển thị tên và độ tin cậy lên ảnh
-            label = f"{person_name} ({confidence_value:.2f}%)"
+        # Draw a filled rectangle as background for text
+        cv2.rectangle(img, (text_x - 5, text_y - label_size[1] - 5),
+                      (text_x + label_size[0] + 5, text_y + 5),
+                      (0, 255, 0), cv2.FILLED)
 
-            # Calculate position for text
-            label_size, _ = cv2.getTextSize(label, self.font, 0.7, 2)
-            text_x = x + (w - label_size[0]) // 2  # Center text horizontally
-            text_y = y - 10 if y - 10 > 10 else y + h + 30
+        # Put text on the image
+        cv2.putText(img, label, (text_x, text_y), self.font, 0.7, (0, 0, 0), 2)
 
-            # Draw a filled rectangle as background for text
-            cv2.rectangle(img, (text_x - 5, text_y - label_size[1] - 5),
-                          (text_x + label_size[0] + 5, text_y + 5),
-                          (0, 255, 0), cv2.FILLED)
+    def recognize_face(self, img):
+        with timed('recognize_face'):
+            return self._recognize_face(img)
 
-            # Put text on the image
-            cv2.putText(img, label, (text_x, text_y), self.font, 0.7, (0, 0, 0), 2)
+    def _recognize_face(self, img):
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        faces = self.detect_faces(gray)
+        # cả khung hình dùng cùng một bản mô hình, kể cả khi mô hình được nạp lại giữa chừng
+        snapshot = self.snapshot
+
+        recognized_faces = []
 
+        for face, (id, confidence_value) in zip(faces, self.identify_faces(gray, faces, snapshot)):
+            person_name = self.name_of(id, snapshot)
+            self.draw_face(img, face, person_name, confidence_value)
+            self.notify(id, confidence_value, snapshot)
             recognized_faces.append((person_name, confidence_value))
 
         return img, recognized_faces
 
 
-def get_face_recognizer(db_cursor):
-    return FaceRecognizer(db_cursor)
+def get_face_recognizer(db_cursor, use_prototypes=False, nprobe=4, detection=None):
+    return FaceRecognizer(db_cursor, use_prototypes, nprobe, detection)
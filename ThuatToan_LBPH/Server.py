@@ -0,0 +1,207 @@
+import argparse
+import os
+import sqlite3
+import threading
+import time
+
+import cv2
+
+from .Detector import DetectionConfig, FaceDetector
+from .Recognize import FaceRecognizer
+
+
+class VideoStream:
+    # source: số thứ tự camera hoặc đường dẫn file video; max_fps: số khung hình tối đa được xử lý mỗi giây
+    def __init__(self, source, max_fps=None, name=None):
+        self.source = source
+        self.name = name or str(source)
+        self.max_fps = max_fps
+        self.capture = cv2.VideoCapture(source)
+        if not self.capture.isOpened():
+            raise IOError(f"Cannot open video source {source}")
+        # camera: một luồng riêng luôn giữ khung hình mới nhất, để không xử lý khung hình cũ trong bộ đệm
+        self.live = isinstance(source, int)
+        self.finished = False
+        self.busy = False
+        self.next_due = 0.0
+        self.frames = 0
+        self.busy_seconds = 0.0
+        self._latest = None
+        self._latest_lock = threading.Lock()
+        if self.live:
+            threading.Thread(target=self._grab_loop, daemon=True).start()
+
+    def _grab_loop(self):
+        while not self.finished:
+            ret, frame = self.capture.read()
+            if not ret:
+                self.finished = True
+                break
+            with self._latest_lock:
+                self._latest = frame
+
+    def read(self):
+        if not self.live:
+            ret, frame = self.capture.read()
+            return frame if ret else None
+        while not self.finished:
+            with self._latest_lock:
+                frame, self._latest = self._latest, None
+            if frame is not None:
+                return frame
+            time.sleep(0.002)
+        return None
+
+    def close(self):
+        self.finished = True
+        self.capture.release()
+
+
+# Dịch vụ nhận diện không giao diện cho nhiều nguồn video: một mô hình dùng chung (chỉ đọc) và một nhóm luồng
+# xử lý. Mỗi nguồn chỉ có tối đa một khung hình đang được xử lý; các nguồn được chọn lần lượt (round-robin)
+# trong số những nguồn đã đến lượt theo giới hạn max_fps, nên không nguồn nào chiếm hết các luồng.
+class RecognitionServer:
+    # on_result(stream_name, frame_index, recognized_faces) được gọi từ luồng xử lý
+    def __init__(self, recognizer, streams, workers=None, detection=None, on_result=None):
+        self.recognizer = recognizer
+        self.streams = list(streams)
+        self.workers = workers or os.cpu_count() or 1
+        self.detection = detection or recognizer.detector.config
+        self.on_result = on_result
+        self._condition = threading.Condition()
+        self._next = 0
+        self._stopped = False
+
+    def run(self, duration=None):
+        start = time.perf_counter()
+        deadline = start + duration if duration else None
+        threads = [threading.Thread(target=self._worker, args=(deadline,), daemon=True)
+                   for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for stream in self.streams:
+            stream.close()
+        return self.report(time.perf_counter() - start)
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+
+    def report(self, elapsed):
+        total_frames = sum(stream.frames for stream in self.streams)
+        cores = min(self.workers, os.cpu_count() or 1)
+        return {
+            'elapsed_s': elapsed,
+            'workers': self.workers,
+            'total_frames': total_frames,
+            'fps': total_frames / elapsed if elapsed > 0 else 0.0,
+            'fps_per_core': total_frames / elapsed / cores if elapsed > 0 else 0.0,
+            'streams': {stream.name: {'frames': stream.frames,
+                                      'fps': stream.frames / elapsed if elapsed > 0 else 0.0,
+                                      'avg_ms': stream.busy_seconds * 1000 / stream.frames if stream.frames else 0.0}
+                        for stream in self.streams},
+        }
+
+    # chọn nguồn tiếp theo theo vòng tròn; chờ nếu mọi nguồn đang bận hoặc chưa đến lượt
+    def _acquire(self, deadline):
+        with self._condition:
+            while True:
+                if self._stopped or all(stream.finished for stream in self.streams):
+                    return None
+                now = time.perf_counter()
+                if deadline is not None and now >= deadline:
+                    return None
+                wait = None
+                for i in range(len(self.streams)):
+                    stream = self.streams[(self._next + i) % len(self.streams)]
+                    if stream.busy or stream.finished:
+                        continue
+                    if stream.next_due <= now:
+                        self._next = (self._next + i + 1) % len(self.streams)
+                        stream.busy = True
+                        return stream
+                    wait = stream.next_due - now if wait is None else min(wait, stream.next_due - now)
+                if deadline is not None:
+                    wait = min(wait, deadline - now) if wait is not None else deadline - now
+                self._condition.wait(wait)
+
+    def _release(self, stream, started):
+        with self._condition:
+            stream.busy = False
+            if stream.max_fps:
+                stream.next_due = started + 1.0 / stream.max_fps
+            self._condition.notify_all()
+
+    def _worker(self, deadline):
+        # CascadeClassifier không dùng chung giữa các luồng; mô hình và bộ so khớp thì dùng chung
+        detector = FaceDetector(self.detection)
+        while True:
+            stream = self._acquire(deadline)
+            if stream is None:
+                return
+            started = time.perf_counter()
+            try:
+                frame = stream.read()
+                if frame is None:
+                    stream.finished = True
+                    continue
+                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                faces = detector.detect(gray)
+                snapshot = self.recognizer.snapshot
+                recognized_faces = [(tuple(int(v) for v in face), self.recognizer.name_of(id, snapshot),
+                                     confidence_value)
+                                    for face, (id, confidence_value)
+                                    in zip(faces, self.recognizer.identify_faces(gray, faces, snapshot))]
+                stream.frames += 1
+                stream.busy_seconds += time.perf_counter() - started
+                if self.on_result is not None:
+                    self.on_result(stream.name, stream.frames, recognized_faces)
+            finally:
+                self._release(stream, started)
+
+
+def _print_result(stream_name, frame_index, recognized_faces):
+    if recognized_faces:
+        faces = ', '.join(f"{name} ({confidence:.2f}%)" for _, name, confidence in recognized_faces)
+        print(f"[{stream_name}#{frame_index}] {faces}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Nhận diện khuôn mặt không giao diện cho nhiều camera/video")
+    parser.add_argument('sources', nargs='+', help="số thứ tự camera hoặc đường dẫn file video")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--max-fps', type=float, default=None, help="giới hạn khung hình/giây cho mỗi nguồn")
+    parser.add_argument('--downscale', type=float, default=2.0)
+    parser.add_argument('--duration', type=float, default=None, help="dừng sau số giây này")
+    parser.add_argument('--db', default='students.db')
+    parser.add_argument('--quiet', action='store_true', help="không in kết quả từng khung hình")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    try:
+        recognizer = FaceRecognizer(conn.cursor(), detection=DetectionConfig(downscale=args.downscale))
+    finally:
+        conn.close()
+    # mô hình được train lại trong lúc server chạy sẽ được nạp tự động
+    recognizer.start_watching()
+    streams = [VideoStream(int(source) if source.isdigit() else source, args.max_fps, name=f"{i}:{source}")
+               for i, source in enumerate(args.sources)]
+    server = RecognitionServer(recognizer, streams, args.workers, on_result=None if args.quiet else _print_result)
+    try:
+        report = server.run(args.duration)
+    except KeyboardInterrupt:
+        server.stop()
+        return
+
+    for name, stream_report in report['streams'].items():
+        print(f"[INFO] {name}: {stream_report['frames']} frames, {stream_report['fps']:.1f} fps, "
+              f"{stream_report['avg_ms']:.1f} ms/frame")
+    print(f"[INFO] {report['total_frames']} frames in {report['elapsed_s']:.1f}s with {report['workers']} workers: "
+          f"{report['fps']:.1f} fps total, {report['fps_per_core']:.1f} fps per core")
+
+
+if __name__ == '__main__':
+    main()
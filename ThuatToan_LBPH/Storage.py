@@ -0,0 +1,368 @@
+import argparse
+import functools
+import hashlib
+import io
+import mmap
+import multiprocessing
+import os
+import re
+import sqlite3
+
+from PIL import Image
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp')
+# ảnh lưu trong cơ sở dữ liệu được thu nhỏ về kích thước này (như add_image trước đây)
+IMAGE_SIZE = (500, 500)
+# ảnh thu nhỏ dùng cho cửa sổ xem ảnh, tính một lần khi thêm ảnh
+THUMBNAIL_SIZE = (200, 200)
+# thư mục chứa ảnh khi dùng FileImageStore
+IMAGE_STORE_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'images')
+
+
+# số sinh viên mỗi trang khi hiển thị danh sách
+PAGE_SIZE = 100
+# unicode61 bỏ dấu tiếng Việt khi so khớp nhưng coi 'đ' là một chữ riêng, nên 'đ' được đổi thành 'd' trước
+FOLD_NAME_SQL = "replace(replace({0}, 'đ', 'd'), 'Đ', 'D')"
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+# Lưu ảnh ngay trong cột face_images.image (cách lưu cũ)
+class BlobImageStore:
+    # trả về giá trị (content_hash, image) để ghi vào face_images
+    def put(self, data):
+        return content_hash(data), data
+
+    # đọc ảnh của một dòng face_images; trả về một đối tượng buffer (bytes, mmap)
+    def open(self, image_hash, image):
+        return image
+
+    def read(self, image_hash, image):
+        return bytes(self.open(image_hash, image))
+
+    def discard_unreferenced(self, cursor, hashes):
+        pass
+
+
+# Lưu ảnh thành file theo hash nội dung (images/ab/cd/abcd...), SQLite chỉ giữ msv, số thứ tự và hash.
+# Ảnh trùng nội dung chỉ được lưu một lần; đọc bằng memory map nên không phải chép ảnh vào bộ nhớ.
+# Dòng cũ vẫn còn ảnh trong cột image (chưa chuyển đổi) vẫn đọc được như bình thường.
+class FileImageStore(BlobImageStore):
+    def __init__(self, root=IMAGE_STORE_PATH):
+        self.root = root
+
+    def path(self, image_hash):
+        return os.path.join(self.root, image_hash[:2], image_hash[2:4], image_hash)
+
+    def put(self, data):
+        image_hash = content_hash(data)
+        path = self.path(image_hash)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # ghi file tạm rồi đổi tên, để không bao giờ có file ảnh ghi dở
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as file:
+                file.write(data)
+            os.replace(tmp_path, path)
+        return image_hash, None
+
+    def open(self, image_hash, image):
+        if image is not None:
+            return image
+        with open(self.path(image_hash), 'rb') as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return b''
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def read(self, image_hash, image):
+        if image is not None:
+            return image
+        with open(self.path(image_hash), 'rb') as file:
+            return file.read()
+
+    # xóa file của những hash không còn dòng nào trong face_images tham chiếu tới (gọi sau khi commit)
+    def discard_unreferenced(self, cursor, hashes):
+        for image_hash in set(hashes):
+            cursor.execute("SELECT 1 FROM face_images WHERE content_hash=? LIMIT 1", (image_hash,))
+            if cursor.fetchone() is None:
+                try:
+                    os.remove(self.path(image_hash))
+                except FileNotFoundError:
+                    pass
+
+
+def default_store():
+    return FileImageStore(IMAGE_STORE_PATH)
+
+
+def create_student_tables(cursor):
+    cursor.execute('''CREATE TABLE IF NOT EXISTS students
+                      (msv TEXT PRIMARY KEY,
+                       name TEXT,
+                       birthdate TEXT,
+                       class TEXT)''')
+
+    # chỉ mục tìm kiếm toàn văn theo msv và tên (không dấu, tìm theo tiền tố), đồng bộ bằng trigger
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='students_fts'")
+    new_search_index = cursor.fetchone() is None
+    cursor.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS students_fts USING fts5
+                      (msv, name, tokenize="unicode61 remove_diacritics 2", prefix='1 2 3')''')
+    # xóa theo rowid trước khi thêm: dòng bị INSERT OR REPLACE xóa không kích hoạt trigger xóa
+    cursor.execute(f'''CREATE TRIGGER IF NOT EXISTS students_fts_insert AFTER INSERT ON students BEGIN
+                           DELETE FROM students_fts WHERE rowid = new.rowid;
+                           INSERT INTO students_fts (rowid, msv, name)
+                           VALUES (new.rowid, new.msv, {FOLD_NAME_SQL.format('new.name')});
+                       END''')
+    cursor.execute(f'''CREATE TRIGGER IF NOT EXISTS students_fts_update AFTER UPDATE ON students BEGIN
+                           DELETE FROM students_fts WHERE rowid = old.rowid;
+                           INSERT INTO students_fts (rowid, msv, name)
+                           VALUES (new.rowid, new.msv, {FOLD_NAME_SQL.format('new.name')});
+                       END''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS students_fts_delete AFTER DELETE ON students BEGIN
+                          DELETE FROM students_fts WHERE rowid = old.rowid;
+                      END''')
+    if new_search_index:
+        cursor.execute(f'''INSERT INTO students_fts (rowid, msv, name)
+                           SELECT rowid, msv, {FOLD_NAME_SQL.format('name')} FROM students''')
+
+    cursor.execute('''CREATE TABLE IF NOT EXISTS face_images
+                      (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                       msv TEXT,
+                       image_number INTEGER,
+                       image BLOB,
+                       FOREIGN KEY(msv) REFERENCES students(msv))''')
+    # hash nội dung ảnh: khóa của ảnh trong image store, dùng để bỏ ảnh trùng
+    cursor.execute("PRAGMA table_info(face_images)")
+    if 'content_hash' not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE face_images ADD COLUMN content_hash TEXT")
+    # xem ảnh, đếm ảnh và xóa theo msv không phải quét cả bảng ảnh
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_face_images_msv ON face_images(msv, image_number)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_face_images_hash ON face_images(content_hash)")
+
+    # bảng riêng để việc liệt kê ảnh thu nhỏ không phải đọc các BLOB ảnh lớn
+    cursor.execute('''CREATE TABLE IF NOT EXISTS face_thumbnails
+                      (image_id INTEGER PRIMARY KEY,
+                       thumbnail BLOB,
+                       FOREIGN KEY(image_id) REFERENCES face_images(id))''')
+
+
+# chuyển chuỗi tìm kiếm thành truy vấn FTS5: mọi từ đều phải khớp (theo tiền tố) với msv hoặc tên
+def search_query(search_term):
+    words = re.findall(r'\w+', search_term.replace('đ', 'd').replace('Đ', 'D'))
+    return ' AND '.join(f'"{word}"*' for word in words)
+
+
+# một trang danh sách sinh viên theo rowid, bắt đầu sau after_rowid (phân trang theo khóa nên trang sau
+# cũng nhanh như trang đầu); search_term: chỉ lấy sinh viên khớp chuỗi tìm kiếm
+# trả về các dòng (rowid, msv, name, birthdate, class)
+def fetch_students_page(cursor, after_rowid=-1, search_term=None, limit=PAGE_SIZE):
+    query = search_query(search_term) if search_term else ''
+    if not query:
+        cursor.execute('''SELECT rowid, msv, name, birthdate, class FROM students
+                          WHERE rowid > ? ORDER BY rowid LIMIT ?''', (after_rowid, limit))
+    else:
+        cursor.execute('''SELECT s.rowid, s.msv, s.name, s.birthdate, s.class FROM students_fts f
+                          JOIN students s ON s.rowid = f.rowid
+                          WHERE students_fts MATCH ? AND f.rowid > ? ORDER BY f.rowid LIMIT ?''',
+                       (query, after_rowid, limit))
+    return cursor.fetchall()
+
+
+def _encode(img, format):
+    buffer = io.BytesIO()
+    img.save(buffer, format=format)
+    return buffer.getvalue()
+
+
+def make_thumbnail(img):
+    thumb = img.copy()
+    thumb.thumbnail(THUMBNAIL_SIZE)
+    if thumb.mode not in ('L', 'RGB'):
+        thumb = thumb.convert('RGB')
+    return _encode(thumb, 'JPEG')
+
+
+# giải mã một file ảnh, trả về (ảnh đã thu nhỏ, ảnh thumbnail) dạng bytes; chạy được trong tiến trình con
+def prepare_image(path):
+    with Image.open(path) as img:
+        format = img.format
+        img.thumbnail(IMAGE_SIZE)
+        return _encode(img, format), make_thumbnail(img)
+
+
+def _prepare_item(item):
+    msv, path = item
+    try:
+        return msv, path, prepare_image(path)
+    except (OSError, ValueError) as e:
+        return msv, path, e
+
+
+# chèn các ảnh đã chuẩn bị [(image, thumbnail)] của một sinh viên qua image store; không commit
+# ảnh sinh viên này đã có (cùng nội dung) bị bỏ qua; trả về số ảnh đã thêm
+def insert_images(cursor, msv, prepared, store):
+    cursor.execute("SELECT COALESCE(MAX(image_number), 0) FROM face_images WHERE msv=?", (msv,))
+    image_number = cursor.fetchone()[0]
+    added = 0
+    for image, thumbnail in prepared:
+        image_hash, image = store.put(image)
+        cursor.execute("SELECT 1 FROM face_images WHERE content_hash=? AND msv=? LIMIT 1", (image_hash, msv))
+        if cursor.fetchone() is not None:
+            continue
+        image_number += 1
+        cursor.execute("INSERT INTO face_images (msv, image_number, image, content_hash) VALUES (?, ?, ?, ?)",
+                       (msv, image_number, image, image_hash))
+        cursor.execute("INSERT INTO face_thumbnails (image_id, thumbnail) VALUES (?, ?)",
+                       (cursor.lastrowid, thumbnail))
+        added += 1
+    return added
+
+
+# thêm các file ảnh cho một sinh viên trong một transaction; trả về (số ảnh đã thêm, [(đường dẫn, lỗi)])
+def add_images(conn, msv, paths, store):
+    prepared = []
+    errors = []
+    for path in paths:
+        try:
+            prepared.append(prepare_image(path))
+        except (OSError, ValueError) as e:
+            errors.append((path, e))
+    with conn:
+        added = insert_images(conn.cursor(), msv, prepared, store)
+    return added, errors
+
+
+# xóa ảnh của một sinh viên; trả về hash của các ảnh đã xóa để gọi store.discard_unreferenced sau khi commit
+def delete_images(cursor, msv):
+    cursor.execute("SELECT content_hash FROM face_images WHERE msv=? AND content_hash IS NOT NULL", (msv,))
+    hashes = [row[0] for row in cursor.fetchall()]
+    cursor.execute("DELETE FROM face_thumbnails WHERE image_id IN (SELECT id FROM face_images WHERE msv=?)", (msv,))
+    cursor.execute("DELETE FROM face_images WHERE msv=?", (msv,))
+    return hashes
+
+
+# đọc dần (msv, hash nội dung, hàm đọc ảnh) của mọi ảnh, theo từng lô; ảnh chỉ được đọc qua image store khi
+# gọi hàm đọc, nên bên dùng có thể bỏ qua ảnh theo hash mà không phải đọc file
+def iter_images(conn, store, batch_size=64):
+    cursor = conn.execute("SELECT msv, content_hash, image FROM face_images")
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        for msv, image_hash, image in rows:
+            # dòng cũ chưa migrate chưa có hash nhưng ảnh đã nằm sẵn trong dòng
+            if image_hash is None:
+                image_hash = content_hash(image)
+            yield msv, image_hash, functools.partial(store.read, image_hash, image)
+
+
+# ảnh thu nhỏ của một sinh viên theo thứ tự ảnh; ảnh cũ chưa có thumbnail được tạo và lưu lại lần đầu
+def get_thumbnails(conn, msv, store):
+    missing = conn.execute('''SELECT f.id, f.content_hash, f.image FROM face_images f
+                              LEFT JOIN face_thumbnails t ON t.image_id = f.id
+                              WHERE f.msv=? AND t.image_id IS NULL''', (msv,)).fetchall()
+    if missing:
+        rows = []
+        for image_id, image_hash, image in missing:
+            with Image.open(io.BytesIO(store.open(image_hash, image))) as img:
+                rows.append((image_id, make_thumbnail(img)))
+        with conn:
+            conn.executemany("INSERT INTO face_thumbnails (image_id, thumbnail) VALUES (?, ?)", rows)
+    return [row[0] for row in conn.execute('''SELECT t.thumbnail FROM face_images f
+                                              JOIN face_thumbnails t ON t.image_id = f.id
+                                              WHERE f.msv=? ORDER BY f.image_number''', (msv,))]
+
+
+def list_dataset(dataset_path):
+    items = []
+    for msv in sorted(os.listdir(dataset_path)):
+        person_path = os.path.join(dataset_path, msv)
+        if os.path.isdir(person_path):
+            items.extend((msv, os.path.join(person_path, name)) for name in sorted(os.listdir(person_path))
+                         if name.lower().endswith(IMAGE_EXTENSIONS))
+    return items
+
+
+# nhập cả cây thư mục dataset/<msv>/*.jpg: giải mã và thu nhỏ song song, ghi tất cả trong một transaction
+# sinh viên chưa có trong bảng students được thêm với tên là msv
+def import_dataset(conn, dataset_path, store, workers=None):
+    workers = workers or os.cpu_count() or 1
+    items = list_dataset(dataset_path)
+    if workers > 1 and len(items) > 1:
+        with multiprocessing.Pool(min(workers, len(items))) as pool:
+            results = pool.map(_prepare_item, items, chunksize=4)
+    else:
+        results = [_prepare_item(item) for item in items]
+
+    prepared = {}
+    errors = []
+    for msv, path, result in results:
+        if isinstance(result, Exception):
+            errors.append((path, result))
+        else:
+            prepared.setdefault(msv, []).append(result)
+
+    added = 0
+    with conn:
+        cursor = conn.cursor()
+        for msv, images in prepared.items():
+            cursor.execute("INSERT OR IGNORE INTO students (msv, name) VALUES (?, ?)", (msv, msv))
+            added += insert_images(cursor, msv, images, store)
+    return added, errors
+
+
+# chuyển ảnh đang lưu trong cột image sang store (mặc định FileImageStore), từng lô một transaction,
+# rồi VACUUM để thu nhỏ file cơ sở dữ liệu; chạy lại được nếu bị ngắt giữa chừng
+def migrate(conn, store, batch_size=64):
+    moved = 0
+    last_id = -1
+    while True:
+        rows = conn.execute("SELECT id, image FROM face_images WHERE image IS NOT NULL AND id > ? ORDER BY id LIMIT ?",
+                            (last_id, batch_size)).fetchall()
+        if not rows:
+            break
+        with conn:
+            for image_id, image in rows:
+                image_hash, image = store.put(image)
+                conn.execute("UPDATE face_images SET content_hash=?, image=? WHERE id=?", (image_hash, image, image_id))
+        moved += len(rows)
+        last_id = rows[-1][0]
+    conn.execute("VACUUM")
+    return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Quản lý ảnh khuôn mặt trong cơ sở dữ liệu")
+    parser.add_argument('command', choices=['import', 'migrate'],
+                        help="import: nhập thư mục dataset/<msv>/*.jpg; migrate: chuyển ảnh BLOB sang thư mục ảnh")
+    parser.add_argument('dataset', nargs='?', help="thư mục dataset (cho import)")
+    parser.add_argument('--db', default='students.db')
+    parser.add_argument('--store', default=IMAGE_STORE_PATH, help="thư mục lưu ảnh")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+    if args.command == 'import' and not args.dataset:
+        parser.error("import needs a dataset folder")
+
+    store = FileImageStore(args.store)
+    conn = sqlite3.connect(args.db)
+    try:
+        create_student_tables(conn.cursor())
+        conn.commit()
+        if args.command == 'import':
+            added, errors = import_dataset(conn, args.dataset, store, args.workers)
+            for path, error in errors:
+                print(f"[WARN] Skipped {path}: {error}")
+            print(f"[INFO] Imported {added} images from {args.dataset}")
+        else:
+            size_before = os.path.getsize(args.db)
+            moved = migrate(conn, store)
+            print(f"[INFO] Moved {moved} images to {args.store}, "
+                  f"{args.db}: {size_before / 1e6:.1f} MB -> {os.path.getsize(args.db) / 1e6:.1f} MB")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
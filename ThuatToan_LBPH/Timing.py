@@ -0,0 +1,87 @@
+import os
+import threading
+import time
+
+
+# Thống kê thời gian của một bước xử lý (ms); items: số phần tử đã xử lý (ví dụ số khuôn mặt)
+class StageStats:
+    def __init__(self):
+        self.count = 0
+        self.items = 0
+        self.total_ms = 0.0
+        self.last_ms = 0.0
+        self.max_ms = 0.0
+        self.dropped = 0
+
+    def add(self, elapsed_ms, items=1):
+        self.count += 1
+        self.items += items
+        self.total_ms += elapsed_ms
+        self.last_ms = elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def as_dict(self):
+        return {'count': self.count, 'avg_ms': self.total_ms / self.count if self.count else 0.0,
+                'last_ms': self.last_ms, 'max_ms': self.max_ms, 'dropped': self.dropped,
+                'items': self.items, 'per_item_ms': self.total_ms / self.items if self.items else 0.0}
+
+
+# Đo thời gian các bước nóng (phát hiện, nhận diện, train, nạp mô hình, hiển thị) khi được bật:
+# đặt biến môi trường BTL_AI_TIMING=1 hoặc gọi enable(). Khi tắt, timed() gần như không tốn gì.
+_enabled = os.environ.get('BTL_AI_TIMING', '') not in ('', '0')
+_stats = {}
+_lock = threading.Lock()
+
+
+class _NoTiming:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_TIMING = _NoTiming()
+
+
+class _Timing:
+    def __init__(self, name, items):
+        self.name = name
+        self.items = items
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed_ms = (time.perf_counter() - self.start) * 1000
+        with _lock:
+            stats = _stats.get(self.name)
+            if stats is None:
+                stats = _stats[self.name] = StageStats()
+            stats.add(elapsed_ms, self.items)
+        return False
+
+
+def enable(on=True):
+    global _enabled
+    _enabled = on
+
+
+def enabled():
+    return _enabled
+
+
+# with timed('detect'): ...  ; items: số phần tử được xử lý trong lần đo này
+def timed(name, items=1):
+    return _Timing(name, items) if _enabled else _NO_TIMING
+
+
+def report():
+    with _lock:
+        return {name: stats.as_dict() for name, stats in sorted(_stats.items())}
+
+
+def reset():
+    with _lock:
+        _stats.clear()
@@ -0,0 +1,142 @@
+import cv2
+
+from .Timing import timed
+
+
+class Track:
+    def __init__(self, face, template):
+        self.face = tuple(int(v) for v in face)
+        # ảnh mẫu của khuôn mặt lấy ở lần phát hiện gần nhất, dùng để bám theo giữa các lần phát hiện
+        self.template = template
+        self.score = 1.0
+        # phiếu bầu có suy giảm theo thời gian: id -> (trọng số, tổng độ tin cậy)
+        self.votes = {}
+
+    def vote(self, id, confidence_value, decay):
+        for key, (weight, total) in self.votes.items():
+            self.votes[key] = (weight * decay, total * decay)
+        weight, total = self.votes.get(id, (0.0, 0.0))
+        self.votes[id] = (weight + 1.0, total + confidence_value)
+
+    # danh tính được bầu nhiều nhất và độ tin cậy trung bình của nó
+    def identity(self):
+        if not self.votes:
+            return -1, 0
+        id, (weight, total) = max(self.votes.items(), key=lambda item: item[1][0])
+        return id, round(total / weight, 2)
+
+
+# Chế độ theo dõi cho camera: chỉ chạy Haar cascade và nhận diện mỗi detect_every khung hình (hoặc khi bám
+# theo thất bại); giữa các lần đó mỗi khuôn mặt được bám theo bằng template matching trong vùng lân cận.
+# Danh tính của mỗi track là kết quả bầu chọn qua nhiều lần nhận diện nên nhãn tên không bị nhấp nháy.
+class FaceTracker:
+    def __init__(self, recognizer, detect_every=5, min_track_score=0.6, iou_threshold=0.3, vote_decay=0.8,
+                 search_margin=0.5):
+        self.recognizer = recognizer
+        self.detect_every = detect_every
+        # điểm template matching thấp hơn ngưỡng này thì phát hiện lại ở khung hình sau
+        self.min_track_score = min_track_score
+        self.iou_threshold = iou_threshold
+        self.vote_decay = vote_decay
+        self.search_margin = search_margin
+        self.tracks = []
+        self.frames_since_detection = 0
+        self.force_detection = True
+
+    def reset(self):
+        self.tracks = []
+        self.frames_since_detection = 0
+        self.force_detection = True
+
+    # cùng đầu ra với FaceRecognizer.recognize_face
+    def process(self, img):
+        with timed('track'):
+            return self._process(img)
+
+    def _process(self, img):
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        snapshot = self.recognizer.snapshot
+        if self.force_detection or not self.tracks or self.frames_since_detection + 1 >= self.detect_every:
+            self._detect(gray, snapshot)
+        else:
+            self._follow(gray)
+
+        recognized_faces = []
+        for track in self.tracks:
+            id, confidence_value = track.identity()
+            person_name = self.recognizer.name_of(id, snapshot)
+            self.recognizer.draw_face(img, track.face, person_name, confidence_value)
+            self.recognizer.notify(id, confidence_value, snapshot)
+            recognized_faces.append((person_name, confidence_value))
+        return img, recognized_faces
+
+    def _detect(self, gray, snapshot):
+        self.frames_since_detection = 0
+        self.force_detection = False
+        faces = [tuple(int(v) for v in face) for face in self.recognizer.detect_faces(gray)]
+        identities = self.recognizer.identify_faces(gray, faces, snapshot)
+
+        # ghép khuôn mặt mới phát hiện với track cũ theo IoU (tham lam, cặp IoU lớn nhất trước)
+        pairs = sorted(((iou(track.face, face), t, f) for t, track in enumerate(self.tracks)
+                        for f, face in enumerate(faces)), reverse=True)
+        matched_tracks = {}
+        used_faces = set()
+        for overlap, t, f in pairs:
+            if overlap < self.iou_threshold:
+                break
+            if t in matched_tracks or f in used_faces:
+                continue
+            matched_tracks[t] = f
+            used_faces.add(f)
+
+        tracks = []
+        for t, f in matched_tracks.items():
+            track = self.tracks[t]
+            track.face = faces[f]
+            track.template = _crop(gray, faces[f]).copy()
+            track.score = 1.0
+            track.vote(*identities[f], self.vote_decay)
+            tracks.append(track)
+        for f, face in enumerate(faces):
+            if f not in used_faces:
+                track = Track(face, _crop(gray, face).copy())
+                track.vote(*identities[f], self.vote_decay)
+                tracks.append(track)
+        # track không còn được phát hiện thì bị bỏ
+        self.tracks = tracks
+
+    def _follow(self, gray):
+        self.frames_since_detection += 1
+        height, width = gray.shape
+        for track in self.tracks:
+            x, y, w, h = track.face
+            mx, my = int(w * self.search_margin), int(h * self.search_margin)
+            x0, y0 = max(0, x - mx), max(0, y - my)
+            x1, y1 = min(width, x + w + mx), min(height, y + h + my)
+            window = gray[y0:y1, x0:x1]
+            template = track.template
+            if window.shape[0] < template.shape[0] or window.shape[1] < template.shape[1]:
+                track.score = 0.0
+            else:
+                result = cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED)
+                _, score, _, (dx, dy) = cv2.minMaxLoc(result)
+                track.score = score
+                if score >= self.min_track_score:
+                    track.face = (x0 + dx, y0 + dy, w, h)
+            if track.score < self.min_track_score:
+                self.force_detection = True
+
+
+def _crop(gray, face):
+    x, y, w, h = face
+    return gray[y:y + h, x:x + w]
+
+
+def iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    inter_w = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    inter_h = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = inter_w * inter_h
+    union = aw * ah + bw * bh - inter
+    return inter / union if union > 0 else 0.0
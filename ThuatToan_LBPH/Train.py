@@ -1,93 +1,405 @@
 import cv2
 import numpy as np
 from PIL import Image
+import argparse
+import collections
 import io
+import itertools
+import json
+import multiprocessing
 import os
 import sqlite3
 
+from .AnnIndex import IVFIndex
+from .Augment import FaceNormalization, prepare_training_faces
+from .Detector import DetectionConfig, FaceDetector
+from .FaceCache import FaceCache
+from .LBP import lbp_histogram
+from .ModelStore import LBPHModel
+from .Storage import content_hash, default_store, iter_images
+from .Timing import timed
+
 
 # lấy dữ liệu từ dataset
 def get_images_from_dataset(dataset_path):
-    image_data = []
+    return list(iter_images_from_dataset(dataset_path))
+
+
+# lấy dữ liệu ảnh từ cơ sở dữ liệu (ảnh được đọc qua image store)
+def get_images_from_database(db_cursor, store=None):
+    store = store or default_store()
+    db_cursor.execute("SELECT msv, content_hash, image FROM face_images")
+    return [(msv, store.read(image_hash, image)) for msv, image_hash, image in db_cursor.fetchall()]
+
+
+# đọc dần từng ảnh trong dataset, không giữ cả dataset trong bộ nhớ
+def iter_images_from_dataset(dataset_path):
     for person_folder in os.listdir(dataset_path):
         person_path = os.path.join(dataset_path, person_folder)
         if os.path.isdir(person_path):
             for image_file in os.listdir(person_path):
                 image_path = os.path.join(person_path, image_file)
                 with open(image_path, 'rb') as file:
-                    image_data.append((person_folder, file.read()))
-    return image_data
+                    yield person_folder, file.read()
 
 
-# lấy dữ liệu ảnh từ cơ sở dữ liệu
-def get_images_from_database(db_cursor):
-    db_cursor.execute("SELECT msv, image FROM face_images")
-    return db_cursor.fetchall()
+# đọc dần ảnh từ cơ sở dữ liệu theo từng lô bằng một kết nối riêng (dùng được trong thread train)
+def iter_images_from_database(db_path, batch_size=64, store=None):
+    conn = sqlite3.connect(db_path)
+    try:
+        yield from iter_images(conn, store or default_store(), batch_size)
+    finally:
+        conn.close()
 
 
-# huấn luyện bộ nhận diện khuôn mặt
-def train_face_recognizer(image_data):
-    recognizer = cv2.face.LBPHFaceRecognizer_create(radius=1, neighbors=5, grid_x=5, grid_y=5)
-    # tệp XML chứa mô hình Haar Cascade cho việc phát hiện khuôn mặt.
-    cascade_path = os.path.join(os.path.dirname(__file__), 'haarcascade_frontalface_default.xml')
-    detector = cv2.CascadeClassifier(cascade_path)
+TRAINER_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'trainer')
+MODEL_PATH = os.path.join(TRAINER_DIR, 'trainer.yml')
+# bản nhị phân của cùng mô hình, nạp nhanh hơn nhiều so với trainer.yml (xem ModelStore.py)
+BINARY_MODEL_PATH = os.path.join(TRAINER_DIR, 'trainer.lbph')
+# chỉ mục IVF tùy chọn cho danh sách sinh viên lớn (xem AnnIndex.py)
+INDEX_PATH = os.path.join(TRAINER_DIR, 'trainer_index.npz')
+# ghi lại những ảnh đã được đưa vào mô hình (theo hash nội dung); bảng nhãn -> msv nằm trong chính mô hình
+STATE_PATH = os.path.join(TRAINER_DIR, 'trainer_state.json')
+# ảnh được nhận biết theo hash nội dung giống cột content_hash của face_images
+STATE_HASH = 'sha256'
+# cache các khuôn mặt đã cắt, để không phải chạy lại Haar cascade trên ảnh không đổi
+CACHE_PATH = os.path.join(TRAINER_DIR, 'face_cache.db')
+# tham số phát hiện khi train: giống lúc nhận diện, nhưng ảnh chụp độ phân giải cao được thu nhỏ trước khi phát hiện
+TRAIN_DETECTION = DetectionConfig(max_side=1024)
+# khuôn mặt được đưa về 100x100 và cân bằng histogram trước khi train (và trước khi nhận diện, xem ModelStore.py)
+TRAIN_NORMALIZATION = FaceNormalization(size=(100, 100), equalize=True)
+# mỗi sinh viên giữ tối đa MAX_PER_STUDENT mẫu khác nhau nhất; dưới MIN_PER_STUDENT mẫu thì sinh thêm biến thể
+MAX_PER_STUDENT = 20
+MIN_PER_STUDENT = 5
+
+
+def create_recognizer():
+    return cv2.face.LBPHFaceRecognizer_create(radius=1, neighbors=5, grid_x=5, grid_y=5)
+
+
+def image_key(img_data):
+    return content_hash(img_data)
+
+
+# đường dẫn của một file mô hình (MODEL_PATH, STATE_PATH, ...) trong thư mục trainer_dir
+def _trainer_path(trainer_dir, path):
+    return os.path.join(trainer_dir, os.path.basename(path))
+
+
+# bảng nhãn của mô hình hiện có: msv -> nhãn số (đọc từ labelsInfo của mô hình)
+def load_label_table(trainer_dir=TRAINER_DIR):
+    return {msv: label for label, msv in load_current_model(trainer_dir).label_info.items()}
+
+
+# mô hình đã train (bản nhị phân nếu nó không cũ hơn trainer.yml); không memory map vì file sắp bị thay thế
+def load_current_model(trainer_dir=TRAINER_DIR):
+    model_path = _trainer_path(trainer_dir, MODEL_PATH)
+    binary_path = _trainer_path(trainer_dir, BINARY_MODEL_PATH)
+    if os.path.exists(binary_path) and os.path.getmtime(binary_path) >= os.path.getmtime(model_path):
+        return LBPHModel.load(binary_path, mmap=False)
+    return LBPHModel.read_yaml(model_path)
+
+
+def load_training_state(trainer_dir=TRAINER_DIR):
+    state_path = _trainer_path(trainer_dir, STATE_PATH)
+    if not os.path.exists(state_path) or not os.path.exists(_trainer_path(trainer_dir, MODEL_PATH)):
+        return {'labels': {}, 'images': {}}
+    with open(state_path, 'r', encoding='utf-8') as file:
+        state = json.load(file)
+    # trạng thái cũ ghi ảnh theo SHA-1, không so được với hash lưu trong cơ sở dữ liệu: train lại từ đầu một lần
+    if state.get('hash') != STATE_HASH:
+        state['images'] = {}
+    # mô hình cũ chưa có bảng nhãn thì dùng nhãn trong file trạng thái
+    state['labels'] = load_label_table(trainer_dir) or state.get('labels', {})
+    return state
+
+
+def save_training_state(state, trainer_dir=TRAINER_DIR):
+    _write_atomic(_trainer_path(trainer_dir, STATE_PATH),
+                  lambda path: _dump_json({'hash': STATE_HASH, 'images': state['images']}, path))
+
+
+def _dump_json(data, path):
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(data, file)
+
+
+# ghi vào file tạm cùng thư mục rồi đổi tên, để bên đọc không bao giờ thấy một file ghi dở
+def _write_atomic(path, write):
+    root, ext = os.path.splitext(path)
+    tmp_path = f"{root}.tmp{ext}"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+# lưu mô hình kèm bảng nhãn (labelsInfo: nhãn -> msv) và cách chuẩn hóa khuôn mặt trong cùng một file,
+# ở cả hai định dạng
+def save_model(recognizer, labels, normalization=None, trainer_dir=TRAINER_DIR):
+    for msv, label in labels.items():
+        recognizer.setLabelInfo(label, msv)
+    model = LBPHModel.from_recognizer(recognizer, normalization)
+    _write_atomic(_trainer_path(trainer_dir, MODEL_PATH), model.write_yaml)
+    _write_atomic(_trainer_path(trainer_dir, BINARY_MODEL_PATH), model.save)
+    return model
+
+
+# phát hiện và cắt khuôn mặt trong một ảnh
+def detect_faces(detector, img_data):
+    pil_img = Image.open(io.BytesIO(img_data)).convert('L')
+    img_numpy = np.array(pil_img, 'uint8')
+    face = detector.detect(img_numpy)
+    # chép từng khuôn mặt ra mảng riêng, để không giữ cả ảnh đã giải mã trong bộ nhớ
+    return [img_numpy[y:y + h, x:x + w].copy() for (x, y, w, h) in face], [tuple(box) for box in face]
+
+
+def load_detector(config=TRAIN_DETECTION):
+    return FaceDetector(config)
+
+
+# mỗi tiến trình con trong pool giữ một detector riêng
+_worker_detector = None
+
+
+def _init_worker(config=TRAIN_DETECTION):
+    global _worker_detector
+    _worker_detector = load_detector(config)
 
+
+def _detect_worker(img_data):
+    return detect_faces(_worker_detector, img_data)
+
+
+# tiền xử lý (giải mã, chuyển ảnh xám, phát hiện khuôn mặt) một loạt ảnh (key, img_data)
+# trả về (key, faces) theo đúng thứ tự đầu vào; ảnh có trong cache không phải chạy lại detector
+# có thể truyền một pool dùng chung cho nhiều lô ảnh (pool phải được tạo với cùng config)
+def preprocess_images(items, cache=None, workers=1, chunk_size=4, pool=None, config=TRAIN_DETECTION):
+    items = list(items)
+    results = {}
+    misses = []
+    for key, img_data in items:
+        faces = cache.get(key) if cache is not None else None
+        if faces is None:
+            misses.append((key, img_data))
+        else:
+            results[key] = faces
+
+    if pool is not None and len(misses) > 1:
+        detected = pool.map(_detect_worker, [img_data for _, img_data in misses], chunk_size)
+    elif workers > 1 and len(misses) > 1:
+        with multiprocessing.Pool(min(workers, len(misses)), initializer=_init_worker, initargs=(config,)) as pool:
+            detected = pool.map(_detect_worker, [img_data for _, img_data in misses], chunk_size)
+    else:
+        detector = load_detector(config)
+        detected = [detect_faces(detector, img_data) for _, img_data in misses]
+
+    for (key, _), (faces, boxes) in zip(misses, detected):
+        if cache is not None:
+            cache.put(key, faces, boxes)
+        results[key] = faces
+
+    return [(key, results[key]) for key, _ in items]
+
+
+def _open_source(image_data):
+    return image_data() if callable(image_data) else iter(image_data)
+
+
+def _batches(iterable, batch_size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# đọc ảnh theo từng lô và chỉ giữ lại khuôn mặt đã cắt; ảnh gốc được bỏ ngay sau khi xử lý xong lô
+# bỏ qua các ảnh đã có trong `skip` (ảnh kèm hàm đọc thì không phải đọc); trả về (faces, ids, seen) với
+# seen: hash -> msv của mọi ảnh đã gặp; khuôn mặt được chuẩn hóa ngay trong từng lô (nếu có normalization)
+# nên bộ nhớ chỉ phụ thuộc số khuôn mặt, không phụ thuộc độ phân giải ảnh
+def _collect_faces(image_data, skip, cache, workers, pool, batch_size, config, normalization=None):
     faces = []
     ids = []
+    seen = {}
+    for batch in _batches(_open_source(image_data), batch_size):
+        pending = []
+        for item in batch:
+            if len(item) == 3:
+                msv, key, read = item
+            else:
+                msv, img_data = item
+                key, read = image_key(img_data), None
+            # ảnh trùng nhau chỉ được tính một lần
+            if key in seen:
+                continue
+            seen[key] = msv
+            if key not in skip:
+                pending.append((key, read() if read is not None else img_data))
+        del batch
+        for key, key_faces in preprocess_images(pending, cache, workers, pool=pool, config=config):
+            if normalization is not None:
+                key_faces = [normalization.apply(face) for face in key_faces]
+            faces.extend(key_faces)
+            ids.extend([seen[key]] * len(key_faces))
+    return faces, ids, seen
+
+
+# huấn luyện bộ nhận diện khuôn mặt
+# image_data: danh sách/iterable các cặp (msv, bytes ảnh) hoặc bộ ba (msv, hash nội dung, hàm đọc ảnh) như
+# iter_images_from_database, hoặc hàm trả về một iterator mới (để đọc dạng luồng)
+# incremental=True: chỉ xử lý ảnh mới và dùng recognizer.update(); chỉ train lại từ đầu khi có ảnh/sinh viên bị xóa
+# cache_path=None: không dùng cache khuôn mặt; workers: số tiến trình tiền xử lý ảnh
+# build_index=True: xây thêm chỉ mục IVF để nhận diện nhanh khi có rất nhiều sinh viên; False: xóa chỉ mục;
+# None: giữ như lần train trước (chỉ mục đã có thì được xây lại cho mô hình mới)
+# detection: DetectionConfig dùng để phát hiện khuôn mặt trong ảnh train
+# normalization: FaceNormalization cho khuôn mặt (None: dùng khuôn mặt thô như trước)
+# max_per_student / min_per_student: giới hạn số mẫu của mỗi sinh viên (None / 0: không giới hạn, không sinh thêm)
+# trainer_dir: thư mục ghi mô hình và trạng thái train (ví dụ thư mục tạm khi benchmark)
+def train_face_recognizer(image_data, incremental=False, cache_path=CACHE_PATH, workers=1, batch_size=64,
+                          build_index=None, detection=TRAIN_DETECTION, normalization=TRAIN_NORMALIZATION,
+                          max_per_student=MAX_PER_STUDENT, min_per_student=MIN_PER_STUDENT, trainer_dir=TRAINER_DIR):
+    recognizer = create_recognizer()
+
+    if not os.path.exists(trainer_dir):
+        os.makedirs(trainer_dir)
+
+    state = load_training_state(trainer_dir) if incremental else {'labels': {}, 'images': {}}
+    current_model = load_current_model(trainer_dir) if state['images'] else None
+    if current_model is not None and current_model.normalization != normalization:
+        # không trộn được histogram của hai cách chuẩn hóa khác nhau trong một mô hình
+        print("\n[INFO] Face normalization changed, rebuilding model...")
+        state = {'labels': state['labels'], 'images': {}}
+        current_model = None
+    trained = state['images']
+    # số mẫu của mỗi nhãn đã có trong mô hình
+    existing = {}
+    if current_model is not None:
+        found, counts = np.unique(np.asarray(current_model.labels), return_counts=True)
+        existing = {int(label): int(count) for label, count in zip(found, counts)}
 
     # Tiền xử lý ảnh
-    for msv, img_data in image_data:
-        pil_img = Image.open(io.BytesIO(img_data)).convert('L')
-        img_numpy = np.array(pil_img, 'uint8')
-        face = detector.detectMultiScale(img_numpy)
-        for (x, y, w, h) in face:
-            faces.append(img_numpy[y:y + h, x:x + w])
-            ids.append(msv)
+    cache = FaceCache(cache_path, detection.signature()) if cache_path else None
+    pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(detection,)) if workers > 1 else None
+    try:
+        with timed('train_preprocess'):
+            faces, ids, seen = _collect_faces(image_data, trained, cache, workers, pool, batch_size, detection,
+                                              normalization)
 
-    # Huấn luyện mô hình
-    print("\n[INFO] Training data...")
+        removed = [key for key, msv in trained.items() if seen.get(key) != msv]
+        # sinh viên đã có mẫu trong mô hình mà ảnh mới làm vượt quá max_per_student: mẫu đa dạng nhất phải được
+        # chọn lại trong cả ảnh cũ lẫn ảnh mới, nên cũng train lại từ đầu (nếu không, ảnh mới bị bỏ mà vẫn bị ghi
+        # là đã train); sinh viên mới thì prepare_training_faces tự chọn trong các ảnh của chính sinh viên đó
+        over_budget = []
+        if not removed and trained and max_per_student is not None:
+            new_counts = collections.Counter(ids)
+            for msv, count in new_counts.items():
+                have = existing.get(state['labels'].get(msv), 0)
+                if have > 0 and have + count > max_per_student:
+                    over_budget.append(msv)
+        if removed or over_budget:
+            if removed:
+                print(f"\n[INFO] {len(removed)} trained images were removed or changed, rebuilding model...")
+            else:
+                print(f"\n[INFO] {len(over_budget)} students exceed {max_per_student} samples, rebuilding model...")
+            if not callable(image_data) and iter(image_data) is image_data:
+                raise ValueError("Rebuilding the model needs a list or a function returning a new iterator")
+            state = {'labels': state['labels'], 'images': {}}
+            trained = state['images']
+            faces, ids, seen = _collect_faces(image_data, trained, cache, workers, pool, batch_size, detection,
+                                              normalization)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if cache is not None:
+            cache.close()
+
+    update = bool(trained)
+    new_keys = {key: msv for key, msv in seen.items() if key not in trained}
 
-    if not faces:
+    if not update and not faces:
         print("[ERROR] No faces found in the images. Check your data.")
         return 0
 
-    unique_ids = list(set(ids))
-    id_to_index = {id: index for index, id in enumerate(unique_ids)}
-    numeric_ids = [id_to_index[id] for id in ids]
+    # Nhãn số của mỗi sinh viên được giữ nguyên giữa các lần train
+    labels = state['labels']
+    if not update:
+        present = set(ids)
+        labels = {msv: label for msv, label in labels.items() if msv in present}
+    for msv in ids:
+        if msv not in labels:
+            labels[msv] = max(labels.values(), default=-1) + 1
+    numeric_ids = [labels[msv] for msv in ids]
 
-    recognizer.train(faces, np.array(numeric_ids))
+    # giới hạn số mẫu và sinh thêm biến thể (khuôn mặt đã được chuẩn hóa trong _collect_faces); khi update thì
+    # tính cả số mẫu đã có trong mô hình
+    faces, numeric_ids = prepare_training_faces(
+        faces, numeric_ids,
+        lambda face: lbp_histogram(face, recognizer.getRadius(), recognizer.getNeighbors(),
+                                   recognizer.getGridX(), recognizer.getGridY()),
+        None, max_per_student, min_per_student, existing if update else {})
 
-    # Lưu mô hình
-    trainer_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'trainer')
-    if not os.path.exists(trainer_dir):
-        os.makedirs(trainer_dir)
-    recognizer.write(os.path.join(trainer_dir, 'trainer.yml'))
+    trained.update(new_keys)
+    state['labels'] = labels
+    num_persons = len(labels)
 
-    print(f"\n[INFO] {len(unique_ids)} faces trained. Exiting.")
-    return len(unique_ids)
+    if update and not faces:
+        if new_keys:
+            save_training_state(state, trainer_dir)
+        print(f"\n[INFO] Model is up to date ({num_persons} persons).")
+        return num_persons
 
+    # Huấn luyện mô hình
+    print("\n[INFO] Training data...")
 
-def main():
-    # Path to the dataset folder
-    dataset_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'dataset')
+    with timed('train_fit', len(faces)):
+        if update:
+            recognizer.read(_trainer_path(trainer_dir, MODEL_PATH))
+            recognizer.update(faces, np.array(numeric_ids))
+        else:
+            recognizer.train(faces, np.array(numeric_ids))
+
+    # Lưu mô hình
+    with timed('train_save'):
+        model = save_model(recognizer, labels, normalization, trainer_dir)
+    index_path = _trainer_path(trainer_dir, INDEX_PATH)
+    if build_index is None:
+        build_index = os.path.exists(index_path)
+    if build_index:
+        _write_atomic(index_path, IVFIndex.build(model.histograms).save)
+    elif os.path.exists(index_path):
+        os.remove(index_path)
+    save_training_state(state, trainer_dir)
 
-    # Connect to the database
-    conn = sqlite3.connect('students.db')
-    cursor = conn.cursor()
+    print(f"\n[INFO] {len(faces)} new faces {'added' if update else 'trained'}, {num_persons} persons in model. Exiting.")
+    return num_persons
 
-    # Get images from dataset
-    dataset_images = get_images_from_dataset(dataset_path)
 
-    # Get images from database
-    db_images = get_images_from_database(cursor)
+def main(incremental=False, workers=1, build_index=None):
+    # Path to the dataset folder
+    dataset_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'dataset')
 
-    # Combine images from both sources
-    all_images = dataset_images + db_images
+    # Stream images from the dataset folder and the database, one batch at a time
+    def all_images():
+        return itertools.chain(iter_images_from_dataset(dataset_path),
+                               iter_images_from_database('students.db'))
 
     # Train the face recognizer
-    num_faces_trained = train_face_recognizer(all_images)
+    num_faces_trained = train_face_recognizer(all_images, incremental=incremental, workers=workers,
+                                              build_index=build_index)
 
     print(f"Total faces trained: {num_faces_trained}")
 
-    # Close the database connection
-    conn.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Train mô hình nhận diện từ thư mục dataset và students.db")
+    parser.add_argument('--incremental', action='store_true', help="chỉ thêm ảnh mới vào mô hình hiện có")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    index = parser.add_mutually_exclusive_group()
+    index.add_argument('--build-index', dest='build_index', action='store_true', default=None,
+                       help="xây chỉ mục IVF (mặc định: giữ như lần train trước)")
+    index.add_argument('--no-index', dest='build_index', action='store_false', help="xóa chỉ mục IVF")
+    args = parser.parse_args()
+    main(args.incremental, args.workers, args.build_index)